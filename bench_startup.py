@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""Benchmark create_app() cold and warm start times.
+
+Runs against a throwaway database and exits non-zero when the median warm
+start exceeds the budget, so it can guard startup in CI:
+
+    python3 bench_startup.py [runs] [budget_ms]
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import erp.db
+
+
+def bench(runs=20, budget_ms=50.0):
+    erp.db.DB_PATH = os.path.join(tempfile.mkdtemp(), "erp.db")
+    from erp.app import create_app
+
+    start = time.perf_counter()
+    create_app()
+    cold_ms = (time.perf_counter() - start) * 1000
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        create_app()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    warm_ms = statistics.median(timings)
+    print(f"cold start: {cold_ms:.1f} ms")
+    print(f"warm start: median {warm_ms:.1f} ms, max {max(timings):.1f} ms over {runs} runs")
+    print(f"budget:     {budget_ms:.1f} ms")
+    return warm_ms <= budget_ms
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    runs = int(args[0]) if args else 20
+    budget_ms = float(args[1]) if len(args) > 1 else 50.0
+    sys.exit(0 if bench(runs, budget_ms) else 1)
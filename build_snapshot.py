@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""Build the pre-seeded demo database shipped with Vercel deployments.
+
+Writes erp/seed.db (schema + admin user + seed_data.py, VACUUMed, rollback
+journal so it is a single self-contained file) and erp/seed.db.sha256.
+Run before deploying:
+
+    python3 build_snapshot.py
+"""
+import os
+import sqlite3
+
+import erp.db
+from erp.db import SNAPSHOT_PATH, file_checksum
+
+
+def build(path=SNAPSHOT_PATH):
+    tmp_path = path + ".tmp"
+    for stale in (tmp_path, tmp_path + "-wal", tmp_path + "-shm"):
+        if os.path.exists(stale):
+            os.remove(stale)
+
+    erp.db.DB_PATH = tmp_path
+    from erp.app import _ensure_admin
+    from seed_data import seed
+
+    erp.db.init_db(force=True)
+    _ensure_admin()
+    seed(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    conn.execute("PRAGMA journal_mode = DELETE")
+    conn.execute("VACUUM")
+    conn.close()
+
+    os.replace(tmp_path, path)
+    checksum = file_checksum(path)
+    with open(path + ".sha256", "w") as f:
+        f.write(f"{checksum}  {os.path.basename(path)}\n")
+
+    print(f"Snapshot written to {path} ({os.path.getsize(path)} bytes)")
+    print(f"  sha256 {checksum}")
+
+
+if __name__ == "__main__":
+    build()
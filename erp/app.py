@@ -2,7 +2,8 @@ import os
 import secrets
 from flask import Flask
 from flask_login import LoginManager
-from erp.db import get_db, init_db, DB_PATH
+from erp import outbox, overdue
+from erp.db import get_db, get_meta, set_meta, init_db, init_pool, restore_snapshot
 from erp.auth import auth_bp, User
 from erp.modules.dashboard import dashboard_bp
 from erp.modules.contacts import contacts_bp
@@ -17,6 +18,10 @@ def create_app():
     app = Flask(__name__, template_folder="templates", static_folder="static")
     app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", secrets.token_hex(32))
 
+    init_pool(app)
+    outbox.init_app(app)
+    overdue.init_app(app)
+
     login_manager = LoginManager()
     login_manager.init_app(app)
     login_manager.login_view = "auth.login"
@@ -25,7 +30,6 @@ def create_app():
     def load_user(user_id):
         db = get_db()
         row = db.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
-        db.close()
         if row:
             return User(row)
         return None
@@ -39,21 +43,35 @@ def create_app():
     app.register_blueprint(accounting_bp, url_prefix="/accounting")
     app.register_blueprint(hr_bp, url_prefix="/hr")
 
-    init_db()
-    _ensure_admin()
+    # On Vercel, /tmp is ephemeral — load the prebuilt demo snapshot on cold
+    # starts, falling back to replaying seed_data.py if none was shipped
+    on_vercel = bool(os.environ.get("VERCEL"))
+    restored = on_vercel and restore_snapshot()
+
+    # Warm starts (schema fingerprint matches) skip DDL and seeding entirely
+    if init_db():
+        _ensure_admin()
 
-    # On Vercel, /tmp is ephemeral — auto-seed demo data on cold starts
-    if os.environ.get("VERCEL") and not os.path.exists(DB_PATH + ".seeded"):
+    if on_vercel and not restored:
+        app.logger.warning(
+            "No valid demo snapshot at erp/seed.db; replaying seed_data.py instead. "
+            "Run build_snapshot.py before deploying."
+        )
         _seed_demo_data()
-        open(DB_PATH + ".seeded", "w").close()
 
     return app
 
 
 def _seed_demo_data():
-    """Seed sample data on Vercel cold starts."""
+    """Seed sample data on Vercel cold starts when no snapshot is available."""
     import importlib.util
-    import sys
+
+    db = get_db()
+    seeded = get_meta(db, "demo_seeded")
+    db.close()
+    if seeded:
+        return
+
     spec = importlib.util.spec_from_file_location(
         "seed_data",
         os.path.join(os.path.dirname(os.path.dirname(__file__)), "seed_data.py"),
@@ -62,6 +80,11 @@ def _seed_demo_data():
     spec.loader.exec_module(mod)
     mod.seed()
 
+    db = get_db()
+    set_meta(db, "demo_seeded", "1")
+    db.commit()
+    db.close()
+
 
 def _ensure_admin():
     from werkzeug.security import generate_password_hash
@@ -0,0 +1,88 @@
+"""Process-level cache of the serialized product catalog.
+
+Triggers on ``products`` (migration 14) bump the ``products_version`` row
+of ``app_meta`` whenever a catalog field changes. ``/products/catalog.json``
+serializes the active products once per version and field projection,
+gzips the result once, and serves both from memory; the version is part of
+the ETag and of the URL the order forms fetch, so browsers cache the
+catalog until it changes instead of receiving it inside every form page.
+"""
+import gzip
+import hashlib
+import json
+import threading
+
+from flask import url_for
+
+FIELDS = ("id", "sku", "name", "unit_price", "cost_price", "unit")
+
+
+class CatalogBody:
+    __slots__ = ("version", "etag", "body", "gzipped")
+
+    def __init__(self, version, etag, body, gzipped):
+        self.version = version
+        self.etag = etag
+        self.body = body
+        self.gzipped = gzipped
+
+
+# (version, {fields: CatalogBody}); replaced as a whole when the version changes
+_cache = (None, {})
+_lock = threading.Lock()
+
+
+def version(db):
+    row = db.execute(
+        "SELECT value FROM app_meta WHERE key = 'products_version'"
+    ).fetchone()
+    return row[0] if row else None
+
+
+def parse_fields(value):
+    """Tuple of requested FIELDS in FIELDS order (``id`` always included).
+
+    An empty ``value`` selects every field; raises ValueError for unknown ones.
+    """
+    if not value:
+        return FIELDS
+    requested = {f.strip() for f in value.split(",") if f.strip()}
+    unknown = requested - set(FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown catalog fields: {', '.join(sorted(unknown))}")
+    requested.add("id")
+    return tuple(f for f in FIELDS if f in requested)
+
+
+def _serialize(db, current, fields):
+    rows = db.execute(
+        f"SELECT {', '.join(fields)} FROM products WHERE active = 1 ORDER BY name, id"
+    )
+    body = json.dumps(
+        [dict(zip(fields, row)) for row in rows], separators=(",", ":")
+    ).encode()
+    digest = hashlib.sha1(",".join(fields).encode()).hexdigest()[:8]
+    return CatalogBody(current, f"{current}-{digest}", body, gzip.compress(body, 6))
+
+
+def get(db, fields=FIELDS):
+    """CatalogBody of the active products with ``fields``, from the cache if current."""
+    global _cache
+    current = version(db)
+    cached_version, bodies = _cache
+    if current is not None and current == cached_version and fields in bodies:
+        return bodies[fields]
+    # Read after the version, so a concurrent change only causes a reload
+    entry = _serialize(db, current, fields)
+    if current is not None:
+        with _lock:
+            cached_version, bodies = _cache
+            if cached_version != current:
+                bodies = {}
+            _cache = (current, {**bodies, fields: entry})
+    return entry
+
+
+def url(db, fields=FIELDS):
+    """URL of the current catalog version; cacheable until the catalog changes."""
+    return url_for("products.catalog_json", v=version(db), fields=",".join(fields))
@@ -0,0 +1,64 @@
+"""Process-level cache of the chart of accounts.
+
+Triggers on ``accounts`` (migration 10) bump the ``accounts_version`` row
+of ``app_meta`` on every insert, update or delete, which includes every
+balance change from posting. A lookup reads that one row and only reloads
+the accounts when the version differs from the cached one, so the account
+pickers and the balance reports skip the accounts query until something
+changes, in this worker or any other.
+"""
+
+
+class Account:
+    """Compact account record; ``account["code"]`` works as for a sqlite3.Row."""
+
+    __slots__ = ("id", "code", "name", "account_type", "parent_id", "balance", "active")
+
+    def __init__(self, id, code, name, account_type, parent_id, balance, active):
+        self.id = id
+        self.code = code
+        self.name = name
+        self.account_type = account_type
+        self.parent_id = parent_id
+        self.balance = balance or 0.0
+        self.active = active
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+
+# (version, accounts ordered by code); replaced as a whole, never mutated
+_cache = (None, ())
+
+
+def version(db):
+    row = db.execute(
+        "SELECT value FROM app_meta WHERE key = 'accounts_version'"
+    ).fetchone()
+    return row[0] if row else None
+
+
+def all_accounts(db):
+    """Every account ordered by code, from the cache when it is current."""
+    global _cache
+    current = version(db)
+    cached_version, accounts = _cache
+    if current is None or current != cached_version:
+        # Read after the version, so a concurrent change only causes a reload
+        accounts = tuple(
+            Account(*row) for row in db.execute(
+                """SELECT id, code, name, account_type, parent_id, balance, active
+                   FROM accounts ORDER BY code"""
+            )
+        )
+        _cache = (current, accounts)
+    return accounts
+
+
+def active_accounts(db, account_types=None):
+    """Active accounts ordered by code, optionally of the given types only."""
+    return [
+        a for a in all_accounts(db)
+        if a.active and (not account_types or a.account_type in account_types)
+    ]
+
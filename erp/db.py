@@ -1,29 +1,245 @@
+import hashlib
 import sqlite3
 import os
+import queue
+import threading
+from contextlib import contextmanager
+
+from flask import g, has_app_context, current_app
+
+from erp import sqltrace
 
 if os.environ.get("VERCEL"):
     DB_PATH = "/tmp/erp.db"
 else:
     DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "erp.db")
 
+# Prebuilt, seeded demo database produced by build_snapshot.py
+SNAPSHOT_PATH = os.path.join(os.path.dirname(__file__), "seed.db")
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
+DEFAULT_POOL_SIZE = 8
+DEFAULT_POOL_TIMEOUT = 30.0
+
+
+class PooledConnection(sqlite3.Connection):
+    """A connection that belongs to a ConnectionPool.
+
+    Views still call ``db.close()`` when they are done; for a pooled
+    connection that is a no-op and the connection is handed back to the
+    pool by ``close_db`` when the app context tears down. While ``trace``
+    is set, statements are recorded by erp.sqltrace.
+    """
+
+    pool = None
+    trace = None
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+
+    def _traced_cursor(self):
+        cur = self.cursor(sqltrace.TracingCursor)
+        cur.trace = self.trace
+        return cur
+
+    def execute(self, sql, parameters=()):
+        if self.trace is None:
+            return super().execute(sql, parameters)
+        return self._traced_cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        if self.trace is None:
+            return super().executemany(sql, seq_of_parameters)
+        return self._traced_cursor().executemany(sql, seq_of_parameters)
+
+
+def connect(path, pooled=False):
+    conn = sqlite3.connect(
+        path,
+        factory=PooledConnection,
+        check_same_thread=not pooled,
+    )
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON")
     conn.execute("PRAGMA journal_mode = WAL")
     return conn
 
 
-def init_db():
+class ConnectionPool:
+    """Bounded pool of SQLite connections shared by request threads.
+
+    Connections are opened lazily (PRAGMAs run once, at open) up to
+    ``size``; after that ``acquire`` waits up to ``timeout`` seconds for
+    one to be released.
+    """
+
+    def __init__(self, path, size=DEFAULT_POOL_SIZE, timeout=DEFAULT_POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                conn = connect(self.path, pooled=True)
+                conn.pool = self
+                self._opened += 1
+                return conn
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise RuntimeError(
+                f"Timed out after {self.timeout}s waiting for a database connection"
+            ) from None
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+
+def init_pool(app):
+    """Attach a connection pool to ``app`` and release connections on teardown."""
+    app.config.setdefault(
+        "DB_POOL_SIZE", int(os.environ.get("DB_POOL_SIZE", DEFAULT_POOL_SIZE))
+    )
+    app.config.setdefault("DB_POOL_TIMEOUT", DEFAULT_POOL_TIMEOUT)
+    app.extensions["erp_db_pool"] = ConnectionPool(
+        DB_PATH, app.config["DB_POOL_SIZE"], app.config["DB_POOL_TIMEOUT"]
+    )
+    app.teardown_appcontext(close_db)
+    sqltrace.init_app(app, DB_PATH)
+
+
+def get_db():
+    """Return the current request's connection, or a fresh one outside Flask.
+
+    Inside an app context every call returns the same pooled connection,
+    so ``load_user`` and the view share it.
+    """
+    if not has_app_context() or "erp_db_pool" not in current_app.extensions:
+        return connect(DB_PATH)
+    if "db" not in g:
+        g.db = current_app.extensions["erp_db_pool"].acquire()
+        g.db.trace = g.get("sql_trace")
+    return g.db
+
+
+def close_db(exc=None):
+    conn = g.pop("db", None)
+    if conn is not None:
+        conn.trace = None
+        conn.pool.release(conn)
+
+
+def init_db(force=False):
+    """Create/upgrade the schema and seed the chart of accounts.
+
+    Skipped when the database already carries the current
+    SCHEMA_FINGERPRINT, so a warm start costs a single read. Returns True
+    when the work was actually done.
+    """
     conn = get_db()
+    if not force and schema_is_current(conn):
+        conn.close()
+        return False
     conn.executescript(SCHEMA)
+    migrate(conn)
     _seed_chart_of_accounts(conn)
+    set_meta(conn, "schema_fingerprint", SCHEMA_FINGERPRINT)
     conn.commit()
     conn.close()
+    return True
+
+
+def schema_is_current(conn):
+    return get_meta(conn, "schema_fingerprint") == SCHEMA_FINGERPRINT
+
+
+def get_meta(conn, key):
+    """Read an app_meta value; None if unset or the schema does not exist yet."""
+    try:
+        row = conn.execute(
+            "SELECT value FROM app_meta WHERE key = ?", (key,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+def set_meta(conn, key, value):
+    conn.execute(
+        "INSERT OR REPLACE INTO app_meta (key, value) VALUES (?, ?)", (key, value)
+    )
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def restore_snapshot(path=SNAPSHOT_PATH):
+    """Load the prebuilt snapshot at ``path`` into DB_PATH.
+
+    The expected checksum is read from ``path + ".sha256"`` and recorded in
+    the restored database, so later starts of the same instance only compare
+    two strings. Returns False if no (valid) snapshot was shipped.
+    """
+    try:
+        with open(path + ".sha256") as f:
+            expected = f.read().split()[0]
+    except (FileNotFoundError, IndexError):
+        return False
+
+    conn = connect(DB_PATH)
+    try:
+        if get_meta(conn, "snapshot_checksum") == expected:
+            return True
+        if file_checksum(path) != expected:
+            return False
+        src = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            src.backup(conn)
+        finally:
+            src.close()
+        conn.execute("PRAGMA journal_mode = WAL")
+        set_meta(conn, "snapshot_checksum", expected)
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+
+def migrate(conn):
+    """Apply pending MIGRATIONS, tracking progress in ``PRAGMA user_version``.
+
+    Each migration runs in its own transaction together with the version
+    bump, so an interrupted run resumes at the first unapplied step.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target, script in enumerate(MIGRATIONS[version:], version + 1):
+        conn.executescript(
+            f"BEGIN;\n{script}\nPRAGMA user_version = {target};\nCOMMIT;"
+        )
 
 
 SCHEMA = """
+-- Internal key/value settings (schema fingerprint etc.)
+CREATE TABLE IF NOT EXISTS app_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
 -- Users / Auth
 CREATE TABLE IF NOT EXISTS users (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -232,6 +448,427 @@ CREATE TABLE IF NOT EXISTS leave_requests (
 """
 
 
+# Ordered list of schema changes applied on top of SCHEMA. Never edit or
+# reorder an entry once released; append a new one instead.
+MIGRATIONS = [
+    # 1: secondary indexes for foreign keys and list filters. Each index
+    # matches a WHERE/ORDER BY in a module; check with EXPLAIN QUERY PLAN
+    # when changing those queries.
+    """
+    CREATE INDEX IF NOT EXISTS idx_sales_order_lines_order ON sales_order_lines(order_id);
+    CREATE INDEX IF NOT EXISTS idx_invoice_lines_invoice ON invoice_lines(invoice_id);
+    CREATE INDEX IF NOT EXISTS idx_purchase_order_lines_po ON purchase_order_lines(po_id);
+    CREATE INDEX IF NOT EXISTS idx_journal_lines_entry ON journal_lines(entry_id);
+    CREATE INDEX IF NOT EXISTS idx_journal_lines_account ON journal_lines(account_id, entry_id);
+    CREATE INDEX IF NOT EXISTS idx_stock_movements_product ON stock_movements(product_id, created_at);
+    CREATE INDEX IF NOT EXISTS idx_leave_requests_employee ON leave_requests(employee_id, created_at);
+    CREATE INDEX IF NOT EXISTS idx_leave_requests_created ON leave_requests(created_at);
+    CREATE INDEX IF NOT EXISTS idx_sales_orders_created ON sales_orders(created_at);
+    CREATE INDEX IF NOT EXISTS idx_sales_orders_status ON sales_orders(status, created_at);
+    CREATE INDEX IF NOT EXISTS idx_sales_orders_customer ON sales_orders(customer_id, created_at);
+    CREATE INDEX IF NOT EXISTS idx_invoices_created ON invoices(created_at);
+    CREATE INDEX IF NOT EXISTS idx_invoices_status ON invoices(status, created_at);
+    CREATE INDEX IF NOT EXISTS idx_invoices_customer ON invoices(customer_id, created_at);
+    CREATE INDEX IF NOT EXISTS idx_invoices_sales_order ON invoices(sales_order_id);
+    CREATE INDEX IF NOT EXISTS idx_purchase_orders_created ON purchase_orders(created_at);
+    CREATE INDEX IF NOT EXISTS idx_purchase_orders_status ON purchase_orders(status, created_at);
+    CREATE INDEX IF NOT EXISTS idx_purchase_orders_supplier ON purchase_orders(supplier_id, created_at);
+    CREATE INDEX IF NOT EXISTS idx_contacts_active_name ON contacts(active, name);
+    CREATE INDEX IF NOT EXISTS idx_products_active_name ON products(active, name);
+    CREATE INDEX IF NOT EXISTS idx_products_category ON products(category_id);
+    CREATE INDEX IF NOT EXISTS idx_employees_department ON employees(department_id, active);
+    CREATE INDEX IF NOT EXISTS idx_accounts_active_code ON accounts(active, code);
+    """,
+    # 2: document-number counters (see erp/sequences.py)
+    """
+    CREATE TABLE IF NOT EXISTS sequences (
+        name TEXT PRIMARY KEY,
+        next_value INTEGER NOT NULL
+    );
+    """,
+    # 3: full-text contact search (see contacts.search_contacts). Two
+    # external-content FTS5 indexes over the same columns: word/prefix
+    # matching with bm25 ranking, and trigram for substring matches.
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS contacts_fts USING fts5(
+        name, email, phone, city, tax_id, notes,
+        content='contacts', content_rowid='id', prefix='2 3'
+    );
+    CREATE VIRTUAL TABLE IF NOT EXISTS contacts_trigram USING fts5(
+        name, email, phone, city, tax_id, notes,
+        content='contacts', content_rowid='id', tokenize='trigram'
+    );
+    CREATE TRIGGER IF NOT EXISTS contacts_search_ai AFTER INSERT ON contacts BEGIN
+        INSERT INTO contacts_fts (rowid, name, email, phone, city, tax_id, notes)
+        VALUES (new.id, new.name, new.email, new.phone, new.city, new.tax_id, new.notes);
+        INSERT INTO contacts_trigram (rowid, name, email, phone, city, tax_id, notes)
+        VALUES (new.id, new.name, new.email, new.phone, new.city, new.tax_id, new.notes);
+    END;
+    CREATE TRIGGER IF NOT EXISTS contacts_search_ad AFTER DELETE ON contacts BEGIN
+        INSERT INTO contacts_fts (contacts_fts, rowid, name, email, phone, city, tax_id, notes)
+        VALUES ('delete', old.id, old.name, old.email, old.phone, old.city, old.tax_id, old.notes);
+        INSERT INTO contacts_trigram (contacts_trigram, rowid, name, email, phone, city, tax_id, notes)
+        VALUES ('delete', old.id, old.name, old.email, old.phone, old.city, old.tax_id, old.notes);
+    END;
+    CREATE TRIGGER IF NOT EXISTS contacts_search_au
+    AFTER UPDATE OF name, email, phone, city, tax_id, notes ON contacts BEGIN
+        INSERT INTO contacts_fts (contacts_fts, rowid, name, email, phone, city, tax_id, notes)
+        VALUES ('delete', old.id, old.name, old.email, old.phone, old.city, old.tax_id, old.notes);
+        INSERT INTO contacts_trigram (contacts_trigram, rowid, name, email, phone, city, tax_id, notes)
+        VALUES ('delete', old.id, old.name, old.email, old.phone, old.city, old.tax_id, old.notes);
+        INSERT INTO contacts_fts (rowid, name, email, phone, city, tax_id, notes)
+        VALUES (new.id, new.name, new.email, new.phone, new.city, new.tax_id, new.notes);
+        INSERT INTO contacts_trigram (rowid, name, email, phone, city, tax_id, notes)
+        VALUES (new.id, new.name, new.email, new.phone, new.city, new.tax_id, new.notes);
+    END;
+    INSERT INTO contacts_fts (contacts_fts) VALUES ('rebuild');
+    INSERT INTO contacts_trigram (contacts_trigram) VALUES ('rebuild');
+    """,
+    # 4: dashboard KPIs kept current by triggers (single row, id = 1).
+    # `flask dashboard rebuild-kpis` recomputes them and reports drift.
+    """
+    CREATE TABLE IF NOT EXISTS kpi_counters (
+        id INTEGER PRIMARY KEY CHECK(id = 1),
+        total_contacts INTEGER NOT NULL DEFAULT 0,
+        total_products INTEGER NOT NULL DEFAULT 0,
+        total_sales_orders INTEGER NOT NULL DEFAULT 0,
+        total_purchase_orders INTEGER NOT NULL DEFAULT 0,
+        pending_invoices INTEGER NOT NULL DEFAULT 0,
+        total_revenue REAL NOT NULL DEFAULT 0
+    );
+    INSERT OR REPLACE INTO kpi_counters VALUES (
+        1,
+        (SELECT COUNT(*) FROM contacts),
+        (SELECT COUNT(*) FROM products),
+        (SELECT COUNT(*) FROM sales_orders),
+        (SELECT COUNT(*) FROM purchase_orders),
+        (SELECT COUNT(*) FROM invoices WHERE status IN ('draft', 'sent')),
+        (SELECT COALESCE(SUM(total), 0) FROM invoices WHERE status = 'paid')
+    );
+    CREATE TRIGGER IF NOT EXISTS kpi_contacts_ai AFTER INSERT ON contacts BEGIN
+        UPDATE kpi_counters SET total_contacts = total_contacts + 1 WHERE id = 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS kpi_contacts_ad AFTER DELETE ON contacts BEGIN
+        UPDATE kpi_counters SET total_contacts = total_contacts - 1 WHERE id = 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS kpi_products_ai AFTER INSERT ON products BEGIN
+        UPDATE kpi_counters SET total_products = total_products + 1 WHERE id = 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS kpi_products_ad AFTER DELETE ON products BEGIN
+        UPDATE kpi_counters SET total_products = total_products - 1 WHERE id = 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS kpi_sales_orders_ai AFTER INSERT ON sales_orders BEGIN
+        UPDATE kpi_counters SET total_sales_orders = total_sales_orders + 1 WHERE id = 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS kpi_sales_orders_ad AFTER DELETE ON sales_orders BEGIN
+        UPDATE kpi_counters SET total_sales_orders = total_sales_orders - 1 WHERE id = 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS kpi_purchase_orders_ai AFTER INSERT ON purchase_orders BEGIN
+        UPDATE kpi_counters SET total_purchase_orders = total_purchase_orders + 1 WHERE id = 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS kpi_purchase_orders_ad AFTER DELETE ON purchase_orders BEGIN
+        UPDATE kpi_counters SET total_purchase_orders = total_purchase_orders - 1 WHERE id = 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS kpi_invoices_ai AFTER INSERT ON invoices BEGIN
+        UPDATE kpi_counters SET
+            pending_invoices = pending_invoices + (new.status IN ('draft', 'sent')),
+            total_revenue = total_revenue + CASE WHEN new.status = 'paid' THEN new.total ELSE 0 END
+        WHERE id = 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS kpi_invoices_ad AFTER DELETE ON invoices BEGIN
+        UPDATE kpi_counters SET
+            pending_invoices = pending_invoices - (old.status IN ('draft', 'sent')),
+            total_revenue = total_revenue - CASE WHEN old.status = 'paid' THEN old.total ELSE 0 END
+        WHERE id = 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS kpi_invoices_au AFTER UPDATE OF status, total ON invoices BEGIN
+        UPDATE kpi_counters SET
+            pending_invoices = pending_invoices
+                - (old.status IN ('draft', 'sent')) + (new.status IN ('draft', 'sent')),
+            total_revenue = total_revenue
+                - CASE WHEN old.status = 'paid' THEN old.total ELSE 0 END
+                + CASE WHEN new.status = 'paid' THEN new.total ELSE 0 END
+        WHERE id = 1;
+    END;
+    """,
+    # 5: posted debit/credit per account and month, maintained by
+    # erp.ledger when entries are posted. Rebuild with
+    # `flask accounting rebuild-ledger`.
+    """
+    CREATE TABLE IF NOT EXISTS period_balances (
+        account_id INTEGER NOT NULL REFERENCES accounts(id),
+        period TEXT NOT NULL,
+        debit REAL NOT NULL DEFAULT 0,
+        credit REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (account_id, period)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_journal_entries_date ON journal_entries(entry_date);
+    INSERT OR REPLACE INTO period_balances (account_id, period, debit, credit)
+    SELECT jl.account_id, substr(je.entry_date, 1, 7), SUM(jl.debit), SUM(jl.credit)
+    FROM journal_lines jl
+    JOIN journal_entries je ON je.id = jl.entry_id
+    WHERE je.posted = 1
+    GROUP BY jl.account_id, substr(je.entry_date, 1, 7);
+    """,
+    # 6: running-balance ledger. Posted lines carry their entry's date and
+    # the account balance after the line (see erp.ledger); as-of balances
+    # are one seek on (account_id, entry_date, id).
+    """
+    ALTER TABLE journal_lines ADD COLUMN entry_date DATE;
+    ALTER TABLE journal_lines ADD COLUMN running_balance REAL;
+    CREATE INDEX IF NOT EXISTS idx_journal_lines_ledger
+        ON journal_lines(account_id, entry_date, id);
+    UPDATE journal_lines SET entry_date = (
+        SELECT je.entry_date FROM journal_entries je
+        WHERE je.id = journal_lines.entry_id AND je.posted = 1
+    );
+    UPDATE journal_lines AS jl SET running_balance = rb.balance
+    FROM (
+        SELECT l.id, SUM(CASE WHEN a.account_type IN ('asset', 'expense')
+                              THEN l.debit - l.credit ELSE l.credit - l.debit END)
+                     OVER (PARTITION BY l.account_id ORDER BY l.entry_date, l.id) AS balance
+        FROM journal_lines l
+        JOIN accounts a ON a.id = l.account_id
+        WHERE l.entry_date IS NOT NULL
+    ) AS rb
+    WHERE jl.id = rb.id;
+    """,
+    # 7: entry totals stored on the header so the journal list never reads
+    # journal_lines. The (entry_date, id) list order is served by
+    # idx_journal_entries_date from migration 5.
+    """
+    ALTER TABLE journal_entries ADD COLUMN total_debit REAL NOT NULL DEFAULT 0;
+    ALTER TABLE journal_entries ADD COLUMN total_credit REAL NOT NULL DEFAULT 0;
+    UPDATE journal_entries AS je SET total_debit = t.debit, total_credit = t.credit
+    FROM (SELECT entry_id, SUM(debit) AS debit, SUM(credit) AS credit
+          FROM journal_lines GROUP BY entry_id) AS t
+    WHERE je.id = t.entry_id;
+    """,
+    # 8: transactional outbox of business events awaiting automatic ledger
+    # postings (see erp.outbox)
+    """
+    CREATE TABLE IF NOT EXISTS ledger_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event TEXT NOT NULL,
+        document_id INTEGER NOT NULL,
+        payload TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        processed_at TIMESTAMP,
+        entry_id INTEGER REFERENCES journal_entries(id),
+        error TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_ledger_outbox_pending
+        ON ledger_outbox(id) WHERE processed_at IS NULL AND error IS NULL;
+    """,
+    # 9: fiscal period closes (see erp.period_close). Entries dated on or
+    # before the latest end_date live in the archive database; the closing
+    # and brought-forward entry ids are not foreign keys for that reason.
+    """
+    CREATE TABLE IF NOT EXISTS fiscal_periods (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        period TEXT NOT NULL UNIQUE,
+        start_date DATE,
+        end_date DATE NOT NULL,
+        net_income REAL NOT NULL DEFAULT 0,
+        closing_entry_id INTEGER,
+        opening_entry_id INTEGER,
+        entries_archived INTEGER NOT NULL DEFAULT 0,
+        lines_archived INTEGER NOT NULL DEFAULT 0,
+        closed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """,
+    # 10: version of the chart of accounts for the cache in erp.chart;
+    # bumped by any change to accounts, including posted balances
+    """
+    INSERT OR IGNORE INTO app_meta (key, value) VALUES ('accounts_version', 0);
+    CREATE TRIGGER IF NOT EXISTS accounts_version_ai AFTER INSERT ON accounts BEGIN
+        UPDATE app_meta SET value = value + 1 WHERE key = 'accounts_version';
+    END;
+    CREATE TRIGGER IF NOT EXISTS accounts_version_au AFTER UPDATE ON accounts BEGIN
+        UPDATE app_meta SET value = value + 1 WHERE key = 'accounts_version';
+    END;
+    CREATE TRIGGER IF NOT EXISTS accounts_version_ad AFTER DELETE ON accounts BEGIN
+        UPDATE app_meta SET value = value + 1 WHERE key = 'accounts_version';
+    END;
+    """,
+    # 11: covering partial index over unpaid invoices for the AR aging
+    # report (see sales.OPEN_INVOICES); its size follows open items, not history
+    """
+    CREATE INDEX IF NOT EXISTS idx_invoices_open
+        ON invoices(customer_id, due_date, invoice_date, total, amount_paid, status)
+        WHERE status IN ('draft', 'sent', 'overdue');
+    """,
+    # 12: per-customer payment terms, due dates for existing invoices at the
+    # default 30 days (erp.overdue), the index the overdue sweep runs on and
+    # a log of scheduled job runs
+    """
+    ALTER TABLE contacts ADD COLUMN payment_terms_days INTEGER;
+    UPDATE invoices SET due_date = date(invoice_date, '+30 days') WHERE due_date IS NULL;
+    CREATE INDEX IF NOT EXISTS idx_invoices_sent_due ON invoices(due_date)
+        WHERE status = 'sent';
+    CREATE TABLE IF NOT EXISTS job_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        job TEXT NOT NULL,
+        ran_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        rows INTEGER NOT NULL DEFAULT 0,
+        seconds REAL NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_job_runs_job ON job_runs(job, id);
+    """,
+    # 13: customer payments from bank statements (erp.payments) and their
+    # allocation to invoices. transaction_id is the bank's entry reference;
+    # it is unique so a statement imported twice books nothing twice.
+    """
+    CREATE TABLE IF NOT EXISTS payments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        payment_date DATE NOT NULL,
+        amount REAL NOT NULL,
+        allocated REAL NOT NULL DEFAULT 0,
+        customer_id INTEGER REFERENCES contacts(id),
+        reference TEXT,
+        counterparty TEXT,
+        transaction_id TEXT,
+        status TEXT NOT NULL DEFAULT 'unmatched'
+            CHECK(status IN ('unmatched', 'partial', 'matched')),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_transaction ON payments(transaction_id)
+        WHERE transaction_id IS NOT NULL;
+    CREATE INDEX IF NOT EXISTS idx_payments_created ON payments(created_at);
+    CREATE INDEX IF NOT EXISTS idx_payments_status ON payments(status, created_at);
+    CREATE TABLE IF NOT EXISTS payment_allocations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        payment_id INTEGER NOT NULL REFERENCES payments(id) ON DELETE CASCADE,
+        invoice_id INTEGER NOT NULL REFERENCES invoices(id),
+        amount REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_payment_allocations_payment
+        ON payment_allocations(payment_id);
+    CREATE INDEX IF NOT EXISTS idx_payment_allocations_invoice
+        ON payment_allocations(invoice_id);
+    """,
+    # 14: version of the product catalog for the cached catalog.json in
+    # erp.catalog; stock movements do not change the catalog
+    """
+    INSERT OR IGNORE INTO app_meta (key, value) VALUES ('products_version', 0);
+    CREATE TRIGGER IF NOT EXISTS products_version_ai AFTER INSERT ON products BEGIN
+        UPDATE app_meta SET value = value + 1 WHERE key = 'products_version';
+    END;
+    CREATE TRIGGER IF NOT EXISTS products_version_au
+        AFTER UPDATE OF sku, name, unit_price, cost_price, unit, active ON products BEGIN
+        UPDATE app_meta SET value = value + 1 WHERE key = 'products_version';
+    END;
+    CREATE TRIGGER IF NOT EXISTS products_version_ad AFTER DELETE ON products BEGIN
+        UPDATE app_meta SET value = value + 1 WHERE key = 'products_version';
+    END;
+    """,
+    # 15: overdue invoices (erp.overdue) are still pending on the dashboard;
+    # the migration 4 invoice triggers only counted draft and sent
+    """
+    DROP TRIGGER IF EXISTS kpi_invoices_ai;
+    DROP TRIGGER IF EXISTS kpi_invoices_ad;
+    DROP TRIGGER IF EXISTS kpi_invoices_au;
+    CREATE TRIGGER kpi_invoices_ai AFTER INSERT ON invoices BEGIN
+        UPDATE kpi_counters SET
+            pending_invoices = pending_invoices + (new.status IN ('draft', 'sent', 'overdue')),
+            total_revenue = total_revenue + CASE WHEN new.status = 'paid' THEN new.total ELSE 0 END
+        WHERE id = 1;
+    END;
+    CREATE TRIGGER kpi_invoices_ad AFTER DELETE ON invoices BEGIN
+        UPDATE kpi_counters SET
+            pending_invoices = pending_invoices - (old.status IN ('draft', 'sent', 'overdue')),
+            total_revenue = total_revenue - CASE WHEN old.status = 'paid' THEN old.total ELSE 0 END
+        WHERE id = 1;
+    END;
+    CREATE TRIGGER kpi_invoices_au AFTER UPDATE OF status, total ON invoices BEGIN
+        UPDATE kpi_counters SET
+            pending_invoices = pending_invoices
+                - (old.status IN ('draft', 'sent', 'overdue'))
+                + (new.status IN ('draft', 'sent', 'overdue')),
+            total_revenue = total_revenue
+                - CASE WHEN old.status = 'paid' THEN old.total ELSE 0 END
+                + CASE WHEN new.status = 'paid' THEN new.total ELSE 0 END
+        WHERE id = 1;
+    END;
+    UPDATE kpi_counters
+    SET pending_invoices = (SELECT COUNT(*) FROM invoices
+                            WHERE status IN ('draft', 'sent', 'overdue'))
+    WHERE id = 1;
+    """,
+]
+
+# Changes whenever SCHEMA or MIGRATIONS change, forcing init_db() to run.
+SCHEMA_FINGERPRINT = hashlib.sha256(
+    "\n".join([SCHEMA, *MIGRATIONS]).encode()
+).hexdigest()[:16]
+
+
+# Journal history of closed fiscal periods, attached as ``archive``. Same
+# columns as the hot tables, without foreign keys into the main database.
+ARCHIVE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS archive.journal_entries (
+        id INTEGER PRIMARY KEY,
+        entry_date DATE NOT NULL,
+        reference TEXT,
+        description TEXT,
+        posted INTEGER DEFAULT 0,
+        created_at TIMESTAMP,
+        total_debit REAL NOT NULL DEFAULT 0,
+        total_credit REAL NOT NULL DEFAULT 0
+    )""",
+    """CREATE TABLE IF NOT EXISTS archive.journal_lines (
+        id INTEGER PRIMARY KEY,
+        entry_id INTEGER NOT NULL,
+        account_id INTEGER NOT NULL,
+        debit REAL DEFAULT 0,
+        credit REAL DEFAULT 0,
+        description TEXT,
+        entry_date DATE,
+        running_balance REAL
+    )""",
+    """CREATE TABLE IF NOT EXISTS archive.ledger_outbox (
+        id INTEGER PRIMARY KEY,
+        event TEXT NOT NULL,
+        document_id INTEGER NOT NULL,
+        payload TEXT NOT NULL,
+        created_at TIMESTAMP,
+        processed_at TIMESTAMP,
+        entry_id INTEGER,
+        error TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS archive.idx_journal_entries_date "
+    "ON journal_entries(entry_date)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_journal_lines_entry ON journal_lines(entry_id)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_journal_lines_ledger "
+    "ON journal_lines(account_id, entry_date, id)",
+]
+
+
+def archive_path():
+    """Path of the archive database that sits next to DB_PATH."""
+    return os.path.splitext(DB_PATH)[0] + "-archive.db"
+
+
+@contextmanager
+def attach_archive(conn):
+    """Attach the archive database as ``archive`` for the duration of the block.
+
+    ATTACH and DETACH are not allowed inside a transaction, so the caller
+    must have committed before entering and before leaving the block. A
+    connection that already has it attached is left as it is.
+    """
+    attached = any(row[1] == "archive" for row in conn.execute("PRAGMA database_list"))
+    if not attached:
+        conn.execute("ATTACH DATABASE ? AS archive", (archive_path(),))
+        for statement in ARCHIVE_SCHEMA:
+            conn.execute(statement)
+    try:
+        yield conn
+    finally:
+        if not attached:
+            conn.execute("DETACH DATABASE archive")
+
+
 def _seed_chart_of_accounts(conn):
     existing = conn.execute("SELECT COUNT(*) FROM accounts").fetchone()[0]
     if existing > 0:
@@ -0,0 +1,180 @@
+"""Bulk invoicing of confirmed and shipped sales orders.
+
+invoice_orders() invoices every order matching the filters ``chunk_size``
+orders at a time, each chunk in its own ``BEGIN IMMEDIATE`` transaction:
+
+1. pick the next orders still in an invoiceable status (by id);
+2. reserve a block of invoice numbers with one sequence allocation;
+3. copy the order headers into ``invoices`` and the order lines into
+   ``invoice_lines`` with one INSERT ... SELECT each, and enqueue the
+   ``invoice_created`` ledger events the same way;
+4. flip the orders to ``invoiced``.
+
+An order is invoiced and flipped in the same transaction, so an interrupted
+run leaves no half-invoiced orders; running it again with the same filters
+picks up exactly the orders that are left. Orders that already have a
+non-cancelled invoice are never picked, even if their status says otherwise.
+"""
+import time
+from datetime import date
+
+from erp import outbox
+
+INVOICEABLE_STATUSES = ("confirmed", "shipped")
+DEFAULT_CHUNK_SIZE = 500
+# Condition on ``so``: the order has no invoice yet, other than cancelled ones
+NOT_INVOICED = """NOT EXISTS (SELECT 1 FROM invoices i
+                  WHERE i.sales_order_id = so.id AND i.status != 'cancelled')"""
+
+
+class InvoiceRunResult:
+    __slots__ = ("orders", "lines", "chunks", "first_number", "last_number", "seconds")
+
+    def __init__(self):
+        self.orders = 0
+        self.lines = 0
+        self.chunks = 0
+        self.first_number = None
+        self.last_number = None
+        self.seconds = 0.0
+
+    @property
+    def orders_per_second(self):
+        return self.orders / self.seconds if self.seconds else 0.0
+
+
+def order_filters(customer_id=None, date_from=None, date_to=None, status=None):
+    """``(conditions, params)`` selecting invoiceable orders on ``so``.
+
+    Orders that already have an invoice other than a cancelled one are left
+    out, whatever their status. Dates are order dates. ``status`` narrows
+    INVOICEABLE_STATUSES to one of them; raises ValueError for any other status.
+    """
+    if status and status not in INVOICEABLE_STATUSES:
+        raise ValueError(
+            f"Only {' or '.join(INVOICEABLE_STATUSES)} orders can be invoiced."
+        )
+    statuses = (status,) if status else INVOICEABLE_STATUSES
+    conditions = [
+        f"so.status IN ({', '.join('?' * len(statuses))})",
+        # An order whose status was never flipped must not be billed twice
+        NOT_INVOICED,
+    ]
+    params = list(statuses)
+    if customer_id:
+        conditions.append("so.customer_id = ?")
+        params.append(int(customer_id))
+    if date_from:
+        conditions.append("so.order_date >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append("so.order_date <= ?")
+        params.append(date_to)
+    return conditions, params
+
+
+def count_orders(db, conditions, params):
+    return db.execute(
+        f"SELECT COUNT(*) FROM sales_orders so WHERE {' AND '.join(conditions)}", params
+    ).fetchone()[0]
+
+
+def _invoice_chunk(db, conditions, params, numbers, invoice_date, terms_days, chunk_size,
+                   result):
+    """Invoice up to ``chunk_size`` orders in one transaction; returns how many."""
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        order_ids = [
+            row[0] for row in db.execute(
+                f"""SELECT so.id FROM sales_orders so WHERE {' AND '.join(conditions)}
+                    ORDER BY so.id LIMIT ?""",
+                (*params, chunk_size),
+            )
+        ]
+        if not order_ids:
+            db.rollback()
+            return 0
+
+        # Joins the transaction, so a rollback returns the numbers too
+        invoice_numbers = numbers.next_many(
+            db, len(order_ids), date.fromisoformat(invoice_date)
+        )
+        db.execute("DELETE FROM temp.invoice_run")
+        db.executemany(
+            "INSERT INTO temp.invoice_run (order_id, invoice_number) VALUES (?, ?)",
+            zip(order_ids, invoice_numbers),
+        )
+
+        db.execute(
+            """INSERT INTO invoices
+               (invoice_number, sales_order_id, customer_id, invoice_date, due_date,
+                status, subtotal, tax_amount, total, notes)
+               SELECT r.invoice_number, so.id, so.customer_id, ?,
+                      date(?, '+' || COALESCE(c.payment_terms_days, ?) || ' days'),
+                      'draft', so.subtotal, so.tax_amount, so.total, so.notes
+               FROM temp.invoice_run r
+               JOIN sales_orders so ON so.id = r.order_id
+               JOIN contacts c ON c.id = so.customer_id
+               ORDER BY r.order_id""",
+            (invoice_date, invoice_date, terms_days),
+        )
+        result.lines += db.execute(
+            """INSERT INTO invoice_lines
+               (invoice_id, product_id, description, quantity, unit_price, tax_rate, line_total)
+               SELECT inv.id, sol.product_id, sol.description, sol.quantity,
+                      sol.unit_price, sol.tax_rate, sol.line_total
+               FROM temp.invoice_run r
+               JOIN invoices inv ON inv.invoice_number = r.invoice_number
+               JOIN sales_order_lines sol ON sol.order_id = r.order_id
+               ORDER BY inv.id, sol.id"""
+        ).rowcount
+        outbox.enqueue_select(
+            db, "invoice_created",
+            """SELECT inv.id AS document_id, inv.invoice_date AS entry_date,
+                      inv.invoice_number AS reference, inv.subtotal AS subtotal,
+                      inv.tax_amount AS tax, inv.total AS total
+               FROM temp.invoice_run r
+               JOIN invoices inv ON inv.invoice_number = r.invoice_number
+               ORDER BY inv.id""",
+        )
+        db.execute(
+            """UPDATE sales_orders SET status = 'invoiced'
+               WHERE id IN (SELECT order_id FROM temp.invoice_run)"""
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    result.orders += len(order_ids)
+    result.chunks += 1
+    result.first_number = result.first_number or invoice_numbers[0]
+    result.last_number = invoice_numbers[-1]
+    return len(order_ids)
+
+
+def invoice_orders(db, numbers, conditions, params, invoice_date=None,
+                   terms_days=30, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Invoice every order matching order_filters(); returns an InvoiceRunResult.
+
+    ``numbers`` is the invoice DocumentSequence. Invoices are dated
+    ``invoice_date`` (default today) and fall due after the customer's
+    payment terms, else ``terms_days``. Chunks that already committed stay
+    invoiced if a later chunk fails.
+    """
+    started = time.perf_counter()
+    result = InvoiceRunResult()
+    invoice_date = invoice_date or date.today().isoformat()
+    if db.in_transaction:
+        db.commit()
+    db.execute(
+        """CREATE TEMP TABLE IF NOT EXISTS invoice_run (
+               order_id INTEGER PRIMARY KEY,
+               invoice_number TEXT NOT NULL
+           )"""
+    )
+    while _invoice_chunk(db, conditions, params, numbers, invoice_date, terms_days,
+                         chunk_size, result) == chunk_size:
+        pass
+    result.seconds = time.perf_counter() - started
+    return result
@@ -0,0 +1,251 @@
+"""Bulk import of journal entries from CSV or JSON Lines.
+
+Each row is one journal line with the fields ``entry_date``, ``reference``,
+``description``, ``account_code``, ``debit`` and ``credit``. Consecutive
+rows with the same ``entry_date`` and ``reference`` form one entry, so the
+file is read in a single streaming pass: an entry is validated (account
+codes, amounts, debits equal credits, not in a closed fiscal period) as
+soon as its last row has been read. Valid entries are written
+``chunk_size`` at a time, each chunk in its own transaction via
+ledger.insert_entries (one ``executemany`` for the headers, one for the
+lines); a rejected row or entry is reported and does not stop the rest of
+the file.
+"""
+import csv
+import json
+import time
+from datetime import date
+
+from erp.ledger import closed_through, insert_entries, post_entries
+
+FIELDS = ("entry_date", "reference", "description", "account_code", "debit", "credit")
+FORMATS = ("csv", "jsonl")
+DEFAULT_CHUNK_SIZE = 1000
+
+
+class Rejection:
+    __slots__ = ("line", "reference", "reason")
+
+    def __init__(self, line, reference, reason):
+        self.line = line
+        self.reference = reference
+        self.reason = reason
+
+
+class ImportReport:
+    """Outcome of import_journal()."""
+
+    def __init__(self):
+        self.entries = 0
+        self.lines = 0
+        self.posted = 0
+        self.rejected = []
+        self.seconds = 0.0
+
+    @property
+    def entries_per_second(self):
+        return self.entries / self.seconds if self.seconds else 0.0
+
+
+def format_for(filename):
+    """Guess the import format from a file name; None if unknown."""
+    name = (filename or "").lower()
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    return None
+
+
+def read_rows(text, fmt):
+    """Yield ``(line_number, row_dict)`` from a text stream.
+
+    JSON lines that do not parse yield ``(line_number, None)``. Raises
+    ValueError for an unknown format or a CSV header without FIELDS.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        missing = [f for f in FIELDS if f not in (reader.fieldnames or ())]
+        if missing:
+            raise ValueError(f"CSV header is missing: {', '.join(missing)}")
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == "jsonl":
+        for number, raw in enumerate(text, 1):
+            if not raw.strip():
+                continue
+            try:
+                row = json.loads(raw)
+            except ValueError:
+                row = None
+            yield number, row if isinstance(row, dict) else None
+    else:
+        raise ValueError(f"Unknown import format: {fmt}")
+
+
+def _amount(value):
+    if value in (None, ""):
+        return 0.0
+    amount = round(float(value), 2)
+    if amount < 0:
+        raise ValueError("negative amount")
+    return amount
+
+
+def _parse_line(row, accounts):
+    """Return ``(account_id, debit, credit)`` or raise ValueError."""
+    code = str(row.get("account_code") or "").strip()
+    account_id = accounts.get(code)
+    if account_id is None:
+        raise ValueError(f"unknown account code {code!r}")
+    try:
+        debit = _amount(row.get("debit"))
+        credit = _amount(row.get("credit"))
+    except (TypeError, ValueError):
+        raise ValueError("debit/credit must be non-negative numbers") from None
+    if (debit == 0) == (credit == 0):
+        raise ValueError("exactly one of debit or credit must be non-zero")
+    return account_id, debit, credit
+
+
+def _entries(rows, accounts, closed, report):
+    """Group rows into entries and validate them in one pass.
+
+    Yields ``(entry_date, reference, description, lines)`` for each valid
+    entry; everything else is appended to ``report.rejected``.
+    """
+    key = None
+    first_line = 0
+    header = None
+    lines = []
+    errors = []
+    debit_total = credit_total = 0.0
+    finished = set()
+
+    def close():
+        if key is None:
+            return None
+        if key in finished:
+            report.rejected.append(Rejection(
+                first_line, key[1], "lines of an entry must be contiguous"
+            ))
+            return None
+        finished.add(key)
+        if errors:
+            report.rejected.extend(errors)
+            return None
+        if round(debit_total - credit_total, 2) != 0:
+            report.rejected.append(Rejection(
+                first_line, key[1],
+                f"debits {debit_total:.2f} do not equal credits {credit_total:.2f}",
+            ))
+            return None
+        return header + (lines,)
+
+    for number, row in rows:
+        if row is None:
+            report.rejected.append(Rejection(number, "", "not a JSON object"))
+            continue
+        entry_date = str(row.get("entry_date") or "").strip()
+        reference = str(row.get("reference") or "").strip()
+
+        if (entry_date, reference) != key:
+            entry = close()
+            if entry:
+                yield entry
+            key = (entry_date, reference)
+            first_line = number
+            header = (entry_date, reference, str(row.get("description") or "").strip())
+            lines = []
+            errors = []
+            debit_total = credit_total = 0.0
+            if not reference:
+                errors.append(Rejection(number, reference, "missing reference"))
+            try:
+                date.fromisoformat(entry_date)
+            except ValueError:
+                errors.append(Rejection(number, reference, f"invalid entry_date {entry_date!r}"))
+            else:
+                if closed and entry_date <= closed:
+                    errors.append(Rejection(
+                        number, reference, f"the books are closed through {closed}"
+                    ))
+
+        try:
+            line = _parse_line(row, accounts)
+        except ValueError as e:
+            errors.append(Rejection(number, reference, str(e)))
+            continue
+        lines.append(line)
+        debit_total += line[1]
+        credit_total += line[2]
+
+    entry = close()
+    if entry:
+        yield entry
+
+
+def _write_chunk(db, chunk, report):
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        id_range = insert_entries(db, chunk)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    report.entries += len(chunk)
+    report.lines += sum(len(entry[3]) for entry in chunk)
+    return id_range
+
+
+def import_journal(db, rows, post=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Import the ``(line_number, row)`` pairs from read_rows().
+
+    With ``post`` the imported entries are posted together once every chunk
+    is in, so running balances are restated once rather than per chunk; if
+    that last step is interrupted the entries stay as drafts and can be
+    posted with ``flask accounting post-journal``. Returns an ImportReport.
+    """
+    started = time.perf_counter()
+    report = ImportReport()
+    if db.in_transaction:
+        db.commit()
+
+    # Resolved once per import; active accounts only
+    accounts = {
+        code: account_id
+        for account_id, code in db.execute(
+            "SELECT id, code FROM accounts WHERE active = 1"
+        ).fetchall()
+    }
+
+    closed = closed_through(db)
+
+    id_ranges = []
+    chunk = []
+    for entry in _entries(rows, accounts, closed, report):
+        chunk.append(entry)
+        if len(chunk) >= chunk_size:
+            id_ranges.append(_write_chunk(db, chunk, report))
+            chunk = []
+    if chunk:
+        id_ranges.append(_write_chunk(db, chunk, report))
+
+    # Chunks normally get adjacent ids; merge them into as few ranges as possible
+    merged = []
+    for first, last in id_ranges:
+        if merged and merged[-1][1] + 1 == first:
+            merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    id_ranges = merged
+
+    if post and id_ranges:
+        condition = " OR ".join(["je.id BETWEEN ? AND ?"] * len(id_ranges))
+        report.posted = post_entries(
+            db, [f"({condition})"], [i for r in id_ranges for i in r]
+        ).entries
+        db.commit()
+
+    report.seconds = time.perf_counter() - started
+    return report
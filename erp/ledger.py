@@ -0,0 +1,453 @@
+"""General-ledger bookkeeping shared by the accounting views and commands.
+
+``period_balances`` holds posted debit/credit totals per account and
+calendar month (``YYYY-MM``). Posting an entry adds its lines to the
+entry's month, so a report over any date range only needs the monthly
+buckets it fully covers plus the raw lines of at most two partial months.
+
+Posted journal lines also carry their entry's date and the account's
+``running_balance`` after the line, in ``(entry_date, id)`` order. The
+balance of an account at any date is then the running balance of its last
+line on or before that date: one seek on ``idx_journal_lines_ledger``.
+Unposted lines have both columns NULL.
+
+Entries dated in a closed fiscal period (see erp.period_close) cannot be
+posted; their lines live in the archive database, which is attached only
+for reports that reach back before the close.
+"""
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+from datetime import date, timedelta
+
+from erp.chart import active_accounts
+from erp.db import attach_archive
+
+
+def _month(d):
+    return f"{d.year:04d}-{d.month:02d}"
+
+
+def _month_start(d):
+    return d.replace(day=1)
+
+
+def _next_month_start(d):
+    return (d.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+# Change of an account's balance from one line, in the account's normal
+# direction: assets and expenses increase with debits, the rest with credits
+SIGNED_CHANGE = """CASE WHEN a.account_type IN ('asset', 'expense')
+                        THEN l.debit - l.credit ELSE l.credit - l.debit END"""
+
+
+class PostingResult:
+    """Outcome of a post_entries() call."""
+
+    __slots__ = ("entries", "lines", "accounts", "skipped", "seconds")
+
+    def __init__(self, entries=0, lines=0, accounts=0, skipped=0, seconds=0.0):
+        self.entries = entries
+        self.lines = lines
+        self.accounts = accounts
+        self.skipped = skipped
+        self.seconds = seconds
+
+    @property
+    def entries_per_second(self):
+        return self.entries / self.seconds if self.seconds else 0.0
+
+
+def closed_through(db):
+    """ISO end date of the latest closed fiscal period, or None."""
+    return db.execute("SELECT MAX(end_date) FROM fiscal_periods").fetchone()[0]
+
+
+def entry_filters(date_from=None, date_to=None, reference=None):
+    """``(conditions, params)`` selecting journal entries ``je`` by date range
+    and reference prefix; empty values are ignored."""
+    conditions = []
+    params = []
+    if date_from:
+        conditions.append("je.entry_date >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append("je.entry_date <= ?")
+        params.append(date_to)
+    if reference:
+        conditions.append("je.reference LIKE ? || '%'")
+        params.append(reference)
+    return conditions, params
+
+
+def _next_entry_id(db):
+    # Honour AUTOINCREMENT's high-water mark so ids are never reused
+    return db.execute(
+        """SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence
+                                WHERE name = 'journal_entries'), 0),
+                      COALESCE((SELECT MAX(id) FROM journal_entries), 0)) + 1"""
+    ).fetchone()[0]
+
+
+def insert_entries(db, entries):
+    """Insert unposted entries with two executemany calls (headers, lines).
+
+    ``entries`` is a list of ``(entry_date, reference, description, lines)``
+    with lines as ``(account_id, debit, credit)``. Ids are assigned here, so
+    the caller must hold the write lock (``BEGIN IMMEDIATE``) and commit.
+    Returns the ``(first_id, last_id)`` range of the new entries.
+    """
+    first_id = _next_entry_id(db)
+    headers = []
+    lines = []
+    for entry_id, (entry_date, reference, description, entry_lines) in enumerate(
+        entries, first_id
+    ):
+        headers.append((
+            entry_id, entry_date, reference, description,
+            round(sum(line[1] for line in entry_lines), 2),
+            round(sum(line[2] for line in entry_lines), 2),
+        ))
+        lines.extend((entry_id, *line) for line in entry_lines)
+
+    db.executemany(
+        """INSERT INTO journal_entries
+           (id, entry_date, reference, description, total_debit, total_credit)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        headers,
+    )
+    db.executemany(
+        "INSERT INTO journal_lines (entry_id, account_id, debit, credit) "
+        "VALUES (?, ?, ?, ?)",
+        lines,
+    )
+    return first_id, first_id + len(headers) - 1
+
+
+def post_entries(db, conditions=(), params=()):
+    """Post every unposted entry ``je`` matching ``conditions``, set-based.
+
+    Entries without lines, whose debits and credits differ or that are
+    dated in a closed fiscal period are skipped.
+    Account balances, running balances and period balances are each
+    updated with one aggregated statement for the whole batch, and the
+    entries are flagged posted last. Outside a transaction this starts one
+    with ``BEGIN IMMEDIATE``; the caller commits. Because only
+    unposted entries are selected and everything happens in the caller's
+    transaction, an interrupted run rolls back and can simply be repeated.
+    """
+    started = time.perf_counter()
+    where = " AND ".join(["je.posted = 0", *conditions])
+    # Take the write lock before reading: a deferred transaction that reads
+    # first cannot be upgraded once another connection has committed (WAL)
+    if not db.in_transaction:
+        db.execute("BEGIN IMMEDIATE")
+
+    db.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS posting_batch (entry_id INTEGER PRIMARY KEY)"
+    )
+    db.execute("DELETE FROM posting_batch")
+    closed = closed_through(db) or ""
+    candidates = db.execute(
+        f"""INSERT INTO posting_batch (entry_id)
+            SELECT je.id FROM journal_entries je
+            WHERE {where}
+              AND je.entry_date > ?
+              AND EXISTS (SELECT 1 FROM journal_lines WHERE entry_id = je.id)
+              AND (SELECT ROUND(SUM(debit) - SUM(credit), 2)
+                   FROM journal_lines WHERE entry_id = je.id) = 0""",
+        [*params, closed],
+    ).rowcount
+    skipped = db.execute(
+        f"SELECT COUNT(*) FROM journal_entries je WHERE {where}", params
+    ).fetchone()[0] - candidates
+
+    batch = "entry_id IN (SELECT entry_id FROM posting_batch)"
+    accounts = db.execute(
+        f"""UPDATE accounts SET balance = balance + d.change
+            FROM (SELECT l.account_id, SUM({SIGNED_CHANGE}) AS change
+                  FROM journal_lines l
+                  JOIN accounts a ON a.id = l.account_id
+                  WHERE l.{batch}
+                  GROUP BY l.account_id) AS d
+            WHERE accounts.id = d.account_id"""
+    ).rowcount
+    lines = db.execute(
+        f"""UPDATE journal_lines SET entry_date = (
+                SELECT je.entry_date FROM journal_entries je
+                WHERE je.id = journal_lines.entry_id)
+            WHERE {batch}"""
+    ).rowcount
+    restate_running_balances(db, batch)
+    db.execute(
+        f"""INSERT INTO period_balances (account_id, period, debit, credit)
+            SELECT account_id, substr(entry_date, 1, 7), SUM(debit), SUM(credit)
+            FROM journal_lines WHERE {batch}
+            GROUP BY account_id, substr(entry_date, 1, 7)
+            ON CONFLICT (account_id, period) DO UPDATE SET
+                debit = debit + excluded.debit,
+                credit = credit + excluded.credit"""
+    )
+    db.execute(
+        "UPDATE journal_entries SET posted = 1 "
+        "WHERE id IN (SELECT entry_id FROM posting_batch)"
+    )
+    db.execute("DELETE FROM posting_batch")
+
+    return PostingResult(candidates, lines, accounts, skipped,
+                         time.perf_counter() - started)
+
+
+def post_entry(db, entry_id):
+    """Post a single entry; returns False if it has no lines or does not balance."""
+    return post_entries(db, ["je.id = ?"], [entry_id]).entries == 1
+
+
+def restate_running_balances(db, where, params=()):
+    """Recompute running balances after newly posted lines.
+
+    ``where`` selects the new lines (which must already have ``entry_date``
+    set). For each account they touch, every line from the earliest new
+    line's date onwards is recomputed, starting from the running balance of
+    the last line before that date. Posting in date order therefore only
+    rewrites the new lines; back-dated posts also shift the later lines.
+    """
+    db.execute(
+        f"""UPDATE journal_lines AS jl SET running_balance = rb.balance
+            FROM (
+                SELECT l.id,
+                       COALESCE((SELECT p.running_balance FROM journal_lines p
+                                 WHERE p.account_id = s.account_id
+                                   AND p.entry_date < s.start_date
+                                 ORDER BY p.entry_date DESC, p.id DESC
+                                 LIMIT 1), 0)
+                       + SUM({SIGNED_CHANGE}) OVER (
+                           PARTITION BY l.account_id ORDER BY l.entry_date, l.id
+                       ) AS balance
+                FROM (SELECT account_id, MIN(entry_date) AS start_date
+                      FROM journal_lines WHERE {where}
+                      GROUP BY account_id) s
+                JOIN journal_lines l
+                  ON l.account_id = s.account_id AND l.entry_date >= s.start_date
+                JOIN accounts a ON a.id = l.account_id
+            ) AS rb
+            WHERE jl.id = rb.id""",
+        params,
+    )
+
+
+def rebuild_running_balances(db):
+    """Recompute entry_date/running_balance of every journal line."""
+    db.execute(
+        """UPDATE journal_lines SET running_balance = NULL,
+               entry_date = (SELECT je.entry_date FROM journal_entries je
+                             WHERE je.id = journal_lines.entry_id AND je.posted = 1)"""
+    )
+    restate_running_balances(db, "entry_date IS NOT NULL")
+
+
+# Posted lines of one account with the balance after each line; the first
+# parameter is the opening balance the window sum starts from
+LEDGER_SELECT = f"""SELECT l.id, l.entry_id, l.entry_date, l.debit, l.credit,
+           je.reference, je.description,
+           ? + SUM({SIGNED_CHANGE}) OVER (
+               ORDER BY l.entry_date, l.id ROWS UNBOUNDED PRECEDING
+           ) AS balance
+    FROM journal_lines l
+    JOIN journal_entries je ON je.id = l.entry_id
+    JOIN accounts a ON a.id = l.account_id"""
+
+
+def ledger_filters(account_id, date_from=None, date_to=None):
+    """``(conditions, params)`` for LEDGER_SELECT: posted lines of one account."""
+    conditions = ["l.account_id = ?", "l.entry_date IS NOT NULL"]
+    params = [account_id]
+    if date_from:
+        conditions.append("l.entry_date >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append("l.entry_date <= ?")
+        params.append(date_to)
+    return conditions, params
+
+
+def opening_balance(db, account_id, date_from=None, after_line=None):
+    """Balance a ledger listing starts from.
+
+    That is the running balance of line ``after_line`` when continuing a
+    page, otherwise the balance at the end of the day before ``date_from``
+    (0 for an open start).
+    """
+    if after_line is not None:
+        row = db.execute(
+            "SELECT running_balance FROM journal_lines WHERE id = ? AND account_id = ?",
+            (after_line, account_id),
+        ).fetchone()
+    elif date_from:
+        row = db.execute(
+            """SELECT running_balance FROM journal_lines
+               WHERE account_id = ? AND entry_date < ?
+               ORDER BY entry_date DESC, id DESC LIMIT 1""",
+            (account_id, date_from),
+        ).fetchone()
+    else:
+        row = None
+    return row[0] if row and row[0] is not None else 0.0
+
+
+def account_balances(db, as_of=None, account_types=None):
+    """Active accounts (ordered by code) with their ``balance``.
+
+    Without ``as_of`` this is the current ``accounts.balance`` from the
+    chart-of-accounts cache; with an ISO date it is each account's running
+    balance at the end of that day.
+    """
+    as_of = _parse_date(as_of)
+    if not as_of:
+        return active_accounts(db, account_types)
+
+    conditions = ["a.active = 1"]
+    params = []
+    if account_types:
+        conditions.append(f"a.account_type IN ({', '.join('?' * len(account_types))})")
+        params.extend(account_types)
+
+    # Before the last close the lines are in the archive; on the closing
+    # date itself the brought-forward entry carries the balance
+    closed = _parse_date(closed_through(db))
+    archived = bool(closed and as_of < closed)
+    lines = "archive.journal_lines" if archived else "journal_lines"
+    params.insert(0, as_of.isoformat())
+
+    with attach_archive(db) if archived else nullcontext():
+        return db.execute(
+            f"""SELECT a.id, a.code, a.name, a.account_type,
+                       COALESCE((SELECT jl.running_balance FROM {lines} jl
+                                 WHERE jl.account_id = a.id AND jl.entry_date <= ?
+                                 ORDER BY jl.entry_date DESC, jl.id DESC
+                                 LIMIT 1), 0) AS balance
+                FROM accounts a
+                WHERE {' AND '.join(conditions)}
+                ORDER BY a.code""",
+            params,
+        ).fetchall()
+
+
+def rebuild_entry_totals(db):
+    """Recompute the stored total_debit/total_credit of every journal entry."""
+    db.execute(
+        """UPDATE journal_entries SET
+               total_debit = COALESCE((SELECT SUM(debit) FROM journal_lines
+                                       WHERE entry_id = journal_entries.id), 0),
+               total_credit = COALESCE((SELECT SUM(credit) FROM journal_lines
+                                        WHERE entry_id = journal_entries.id), 0)"""
+    )
+
+
+def rebuild_period_balances(db):
+    """Recompute the buckets of open months from posted journal lines.
+
+    Buckets of closed months are kept: their lines are archived. Returns
+    the total bucket count.
+    """
+    closed = closed_through(db) or ""
+    db.execute("DELETE FROM period_balances WHERE period > ?", (closed[:7],))
+    db.execute(
+        """INSERT INTO period_balances (account_id, period, debit, credit)
+           SELECT jl.account_id, substr(je.entry_date, 1, 7),
+                  SUM(jl.debit), SUM(jl.credit)
+           FROM journal_lines jl
+           JOIN journal_entries je ON je.id = jl.entry_id
+           WHERE je.posted = 1 AND je.entry_date > ?
+           GROUP BY jl.account_id, substr(je.entry_date, 1, 7)""",
+        (closed,),
+    )
+    return db.execute("SELECT COUNT(*) FROM period_balances").fetchone()[0]
+
+
+def _sum_lines(db, totals, first, last, schema="main"):
+    # Closing and brought-forward entries are bookkeeping, not activity
+    rows = db.execute(
+        f"""SELECT jl.account_id, SUM(jl.debit) AS debit, SUM(jl.credit) AS credit
+            FROM {schema}.journal_entries je
+            JOIN {schema}.journal_lines jl ON jl.entry_id = je.id
+            WHERE je.posted = 1 AND je.entry_date BETWEEN ? AND ?
+              AND je.id NOT IN (SELECT closing_entry_id FROM main.fiscal_periods
+                                WHERE closing_entry_id IS NOT NULL
+                                UNION ALL
+                                SELECT opening_entry_id FROM main.fiscal_periods
+                                WHERE opening_entry_id IS NOT NULL)
+            GROUP BY jl.account_id""",
+        (first.isoformat(), last.isoformat()),
+    ).fetchall()
+    for row in rows:
+        totals[row["account_id"]][0] += row["debit"]
+        totals[row["account_id"]][1] += row["credit"]
+
+
+def _add_raw_lines(db, totals, first, last):
+    closed = _parse_date(closed_through(db))
+    if closed and first <= closed:
+        with attach_archive(db):
+            _sum_lines(db, totals, first, min(last, closed), "archive")
+        first = closed + timedelta(days=1)
+    if first <= last:
+        _sum_lines(db, totals, first, last)
+
+
+def period_totals(db, date_from=None, date_to=None):
+    """Posted ``{account_id: [debit, credit]}`` for an inclusive ISO date range.
+
+    Either bound may be empty/None for an open range; invalid dates are
+    treated as empty.
+    """
+    start = _parse_date(date_from)
+    end = _parse_date(date_to)
+    totals = defaultdict(lambda: [0.0, 0.0])
+
+    # Whole months inside the range: [full_start, full_end)
+    full_start = None
+    if start:
+        full_start = start if start.day == 1 else _next_month_start(start)
+    full_end = None
+    if end:
+        after = end + timedelta(days=1)
+        full_end = after if after.day == 1 else _month_start(end)
+
+    if full_start and full_end and full_start >= full_end:
+        # No complete month in range: read the raw lines
+        if start <= end:
+            _add_raw_lines(db, totals, start, end)
+        return totals
+
+    conditions = []
+    params = []
+    if full_start:
+        conditions.append("period >= ?")
+        params.append(_month(full_start))
+    if full_end:
+        conditions.append("period < ?")
+        params.append(_month(full_end))
+    query = "SELECT account_id, SUM(debit) AS debit, SUM(credit) AS credit FROM period_balances"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " GROUP BY account_id"
+    for row in db.execute(query, params).fetchall():
+        totals[row["account_id"]][0] += row["debit"]
+        totals[row["account_id"]][1] += row["credit"]
+
+    if start and start < full_start:
+        _add_raw_lines(db, totals, start, full_start - timedelta(days=1))
+    if end and full_end <= end:
+        _add_raw_lines(db, totals, full_end, end)
+    return totals
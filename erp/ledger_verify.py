@@ -0,0 +1,194 @@
+"""Ledger integrity check: recompute balances from journal lines.
+
+The journal is split into ranges of entry ids, and each range is aggregated
+in a worker process over its own read-only connection. Every entry's lines
+share its id, so each chunk can check whole entries by itself:
+
+* posted entries whose debits and credits differ,
+* entries whose stored ``total_debit``/``total_credit`` disagree with their lines,
+* per-account balance changes from posted lines, summed by the parent and
+  compared with ``accounts.balance`` and with the account's last running
+  balance.
+
+Run it while the ledger is quiet: chunks are read at slightly different
+times, so entries posted during a run can show up as differences.
+"""
+import csv
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from erp.ledger import SIGNED_CHANGE, rebuild_entry_totals, rebuild_running_balances
+
+DEFAULT_CHUNK_SIZE = 50_000
+TOLERANCE = 0.005
+
+
+class Difference:
+    """One mismatch; for ``unbalanced_entry`` stored/actual are debits/credits."""
+
+    __slots__ = ("kind", "id", "label", "stored", "actual")
+
+    def __init__(self, kind, id, label, stored, actual):
+        self.kind = kind
+        self.id = id
+        self.label = label
+        self.stored = stored
+        self.actual = actual
+
+    @property
+    def delta(self):
+        return round((self.actual or 0.0) - (self.stored or 0.0), 2)
+
+
+class VerifyReport:
+    def __init__(self):
+        self.accounts = 0
+        self.entries = 0
+        self.chunks = 0
+        self.differences = []
+        self.repaired = 0
+        self.seconds = 0.0
+
+    @property
+    def ok(self):
+        return not self.differences
+
+
+def _scan_chunk(path, first_id, last_id):
+    """Aggregate entries ``first_id..last_id`` over a read-only connection.
+
+    Returns ``(entries, {account_id: change}, unbalanced, bad_totals)``.
+    """
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        changes = dict(conn.execute(
+            f"""SELECT l.account_id, SUM({SIGNED_CHANGE})
+                FROM journal_lines l
+                JOIN journal_entries je ON je.id = l.entry_id
+                JOIN accounts a ON a.id = l.account_id
+                WHERE l.entry_id BETWEEN ? AND ? AND je.posted = 1
+                GROUP BY l.account_id""",
+            (first_id, last_id),
+        ).fetchall())
+        per_entry = conn.execute(
+            """SELECT je.id, je.reference, je.posted, je.total_debit, je.total_credit,
+                      COALESCE(SUM(l.debit), 0), COALESCE(SUM(l.credit), 0)
+               FROM journal_entries je
+               LEFT JOIN journal_lines l ON l.entry_id = je.id
+               WHERE je.id BETWEEN ? AND ?
+               GROUP BY je.id""",
+            (first_id, last_id),
+        ).fetchall()
+    finally:
+        conn.close()
+
+    unbalanced = []
+    bad_totals = []
+    for entry_id, reference, posted, total_debit, total_credit, debit, credit in per_entry:
+        if posted and abs(debit - credit) > TOLERANCE:
+            unbalanced.append((entry_id, reference, debit, credit))
+        if abs(total_debit - debit) > TOLERANCE or abs(total_credit - credit) > TOLERANCE:
+            bad_totals.append((entry_id, reference, total_debit, debit, total_credit, credit))
+    return len(per_entry), changes, unbalanced, bad_totals
+
+
+def verify(path, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Check the database at ``path``; returns a VerifyReport."""
+    started = time.perf_counter()
+    report = VerifyReport()
+
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        low, high = conn.execute(
+            "SELECT MIN(id), MAX(id) FROM journal_entries"
+        ).fetchone()
+        accounts = conn.execute(
+            """SELECT a.id, a.code, a.balance,
+                      (SELECT l.running_balance FROM journal_lines l
+                       WHERE l.account_id = a.id AND l.entry_date IS NOT NULL
+                       ORDER BY l.entry_date DESC, l.id DESC LIMIT 1)
+               FROM accounts a ORDER BY a.code"""
+        ).fetchall()
+    finally:
+        conn.close()
+
+    ranges = []
+    if low is not None:
+        ranges = [
+            (start, min(start + chunk_size - 1, high))
+            for start in range(low, high + 1, chunk_size)
+        ]
+    report.chunks = len(ranges)
+
+    totals = {}
+    unbalanced = []
+    bad_totals = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(_scan_chunk, path, first, last) for first, last in ranges]
+        for future in futures:
+            entries, changes, chunk_unbalanced, chunk_bad_totals = future.result()
+            report.entries += entries
+            for account_id, change in changes.items():
+                totals[account_id] = totals.get(account_id, 0.0) + change
+            unbalanced.extend(chunk_unbalanced)
+            bad_totals.extend(chunk_bad_totals)
+
+    for account_id, code, balance, running in accounts:
+        report.accounts += 1
+        actual = round(totals.get(account_id, 0.0), 2)
+        if abs((balance or 0.0) - actual) > TOLERANCE:
+            report.differences.append(
+                Difference("account_balance", account_id, code, balance, actual)
+            )
+        if abs((running or 0.0) - actual) > TOLERANCE:
+            report.differences.append(
+                Difference("running_balance", account_id, code, running, actual)
+            )
+    for entry_id, reference, debit, credit in unbalanced:
+        report.differences.append(
+            Difference("unbalanced_entry", entry_id, reference, debit, credit)
+        )
+    for entry_id, reference, total_debit, debit, total_credit, credit in bad_totals:
+        if abs(total_debit - debit) > TOLERANCE:
+            report.differences.append(
+                Difference("entry_total_debit", entry_id, reference, total_debit, debit)
+            )
+        if abs(total_credit - credit) > TOLERANCE:
+            report.differences.append(
+                Difference("entry_total_credit", entry_id, reference, total_credit, credit)
+            )
+
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+def repair(db, report):
+    """Fix what can be derived from the lines; the caller commits.
+
+    Account balances are set to the recomputed values, running balances and
+    entry totals are rebuilt if any of them differed. Unbalanced entries
+    need a human and are left alone. Returns the number of fixes applied.
+    """
+    fixes = [d for d in report.differences if d.kind == "account_balance"]
+    db.executemany(
+        "UPDATE accounts SET balance = ? WHERE id = ?",
+        [(d.actual, d.id) for d in fixes],
+    )
+    kinds = {d.kind for d in report.differences}
+    if "running_balance" in kinds:
+        rebuild_running_balances(db)
+    if kinds & {"entry_total_debit", "entry_total_credit"}:
+        rebuild_entry_totals(db)
+    report.repaired = sum(d.kind != "unbalanced_entry" for d in report.differences)
+    return report.repaired
+
+
+def write_report(report, path):
+    """Write the differences as CSV."""
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["kind", "id", "label", "stored", "actual", "delta"])
+        for d in report.differences:
+            writer.writerow([d.kind, d.id, d.label, d.stored, d.actual, d.delta])
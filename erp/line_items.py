@@ -0,0 +1,48 @@
+"""Parsing, totalling and bulk insertion of document line items."""
+
+TAX_RATE = 0.10
+
+# Column order of the tuples returned by parse_order_lines
+ORDER_LINE_COLUMNS = ("product_id", "quantity", "unit_price", "line_total")
+
+
+def parse_order_lines(form):
+    """Read the ``product_id[]``/``quantity[]``/``unit_price[]`` arrays of a form.
+
+    Rows missing any of the three values are skipped. Returns
+    ``(lines, (subtotal, tax_amount, total))`` where each line is a tuple in
+    ORDER_LINE_COLUMNS order; totals are accumulated in the same pass.
+    """
+    product_ids = form.getlist("product_id[]")
+    quantities = form.getlist("quantity[]")
+    unit_prices = form.getlist("unit_price[]")
+
+    lines = []
+    subtotal = 0.0
+    for pid, qty, price in zip(product_ids, quantities, unit_prices):
+        if not pid or not qty or not price:
+            continue
+        qty = float(qty)
+        price = float(price)
+        line_total = round(qty * price, 2)
+        subtotal += line_total
+        lines.append((int(pid), qty, price, line_total))
+
+    return lines, order_totals(subtotal)
+
+
+def order_totals(subtotal):
+    """Return ``(subtotal, tax_amount, total)`` rounded to cents."""
+    subtotal = round(subtotal, 2)
+    tax_amount = round(subtotal * TAX_RATE, 2)
+    return subtotal, tax_amount, round(subtotal + tax_amount, 2)
+
+
+def insert_lines(db, table, parent_column, parent_id, columns, rows):
+    """Insert ``rows`` (tuples in ``columns`` order) under one parent with executemany."""
+    placeholders = ", ".join("?" * (len(columns) + 1))
+    db.executemany(
+        f"INSERT INTO {table} ({parent_column}, {', '.join(columns)}) "
+        f"VALUES ({placeholders})",
+        ((parent_id, *row) for row in rows),
+    )
@@ -1,6 +1,34 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+import csv
+import io
+from contextlib import nullcontext
+
+import click
+from flask import (
+    Blueprint, Response, render_template, request, redirect, url_for, flash,
+    stream_with_context,
+)
 from flask_login import login_required
-from erp.db import get_db
+from werkzeug.utils import secure_filename
+from erp.chart import active_accounts
+import erp.db
+from erp.db import attach_archive, get_db
+from erp import journal_import, ledger_verify, outbox, period_close, sqltrace
+from erp.ledger import (
+    LEDGER_SELECT,
+    account_balances,
+    closed_through,
+    entry_filters,
+    ledger_filters,
+    opening_balance,
+    period_totals,
+    post_entries,
+    post_entry,
+    rebuild_entry_totals,
+    rebuild_period_balances,
+    rebuild_running_balances,
+)
+from erp.line_items import insert_lines
+from erp.pagination import decode_cursor, paginate
 
 accounting_bp = Blueprint("accounting", __name__, template_folder="../templates")
 
@@ -9,14 +37,12 @@ accounting_bp = Blueprint("accounting", __name__, template_folder="../templates"
 @login_required
 def index():
     db = get_db()
-    accounts = db.execute(
-        "SELECT * FROM accounts WHERE active = 1 ORDER BY code"
-    ).fetchall()
+    accounts = active_accounts(db)
     db.close()
 
     grouped = {}
     for acct_type in ("asset", "liability", "equity", "revenue", "expense"):
-        grouped[acct_type] = [a for a in accounts if a["account_type"] == acct_type]
+        grouped[acct_type] = [a for a in accounts if a.account_type == acct_type]
 
     return render_template("accounting/index.html", grouped=grouped)
 
@@ -65,22 +91,301 @@ def account_new():
     return render_template("accounting/account_form.html", account={})
 
 
+LEDGER_ORDER = [("l.entry_date", "entry_date"), ("l.id", "id")]
+CSV_CHUNK_ROWS = 1000
+IMPORT_REJECTIONS_SHOWN = 200
+
+
+def _ledger_range():
+    return (
+        request.args.get("date_from", "").strip(),
+        request.args.get("date_to", "").strip(),
+    )
+
+
+@accounting_bp.cli.command("rebuild-ledger")
+def rebuild_ledger_command():
+    """Recompute entry totals, period balances and running balances from journal lines."""
+    db = get_db()
+    rebuild_entry_totals(db)
+    count = rebuild_period_balances(db)
+    rebuild_running_balances(db)
+    db.commit()
+    db.close()
+    click.echo(
+        f"Rebuilt entry totals, {count} account-month balances and all running balances."
+    )
+
+
+@accounting_bp.cli.command("post-journal")
+@click.option("--from", "date_from", help="Earliest entry date (YYYY-MM-DD).")
+@click.option("--to", "date_to", help="Latest entry date (YYYY-MM-DD).")
+@click.option("--reference", help="Only entries whose reference starts with this.")
+def post_journal_command(date_from, date_to, reference):
+    """Post all unposted journal entries matching the filters in one transaction."""
+    db = get_db()
+    result = post_entries(db, *entry_filters(date_from, date_to, reference))
+    db.commit()
+    db.close()
+    click.echo(
+        f"Posted {result.entries} entries ({result.lines} lines, "
+        f"{result.accounts} accounts) in {result.seconds:.3f}s "
+        f"({result.entries_per_second:.0f} entries/s); "
+        f"skipped {result.skipped} unbalanced, empty or in a closed period."
+    )
+
+
+@accounting_bp.route("/accounts/<int:id>/ledger")
+@login_required
+def account_ledger(id):
+    date_from, date_to = _ledger_range()
+    after = request.args.get("after")
+
+    db = get_db()
+    account = db.execute("SELECT * FROM accounts WHERE id = ?", (id,)).fetchone()
+    if not account:
+        db.close()
+        flash("Account not found.", "error")
+        return redirect(url_for("accounting.index"))
+
+    cursor = decode_cursor(after)
+    opening = opening_balance(
+        db, id, date_from,
+        cursor[-1] if cursor and len(cursor) == len(LEDGER_ORDER) else None,
+    )
+    conditions, params = ledger_filters(id, date_from, date_to)
+    lines, next_cursor = paginate(
+        db, LEDGER_SELECT, conditions, [opening, *params], LEDGER_ORDER,
+        cursor=after, descending=False,
+    )
+    db.close()
+
+    return render_template(
+        "accounting/ledger.html",
+        account=account,
+        lines=lines,
+        opening=opening,
+        next_cursor=next_cursor,
+        filters={"date_from": date_from, "date_to": date_to},
+    )
+
+
+@accounting_bp.route("/accounts/<int:id>/ledger.csv")
+@login_required
+def account_ledger_csv(id):
+    date_from, date_to = _ledger_range()
+
+    db = get_db()
+    account = db.execute("SELECT code FROM accounts WHERE id = ?", (id,)).fetchone()
+    if not account:
+        db.close()
+        flash("Account not found.", "error")
+        return redirect(url_for("accounting.index"))
+
+    filename = secure_filename(f"ledger-{account['code']}.csv")
+    opening = opening_balance(db, id, date_from)
+    conditions, params = ledger_filters(id, date_from, date_to)
+    rows = db.execute(
+        f"{LEDGER_SELECT} WHERE {' AND '.join(conditions)} "
+        "ORDER BY l.entry_date, l.id",
+        [opening, *params],
+    )
+
+    def generate():
+        # Rows are fetched and encoded a chunk at a time, so memory use does
+        # not grow with the size of the account
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(
+            ["date", "entry_id", "reference", "description", "debit", "credit", "balance"]
+        )
+        while True:
+            chunk = rows.fetchmany(CSV_CHUNK_ROWS)
+            for line in chunk:
+                writer.writerow([
+                    line["entry_date"], line["entry_id"], line["reference"] or "",
+                    line["description"] or "", f"{line['debit']:.2f}",
+                    f"{line['credit']:.2f}", f"{line['balance']:.2f}",
+                ])
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            if not chunk:
+                break
+        db.close()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/csv",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"'
+        },
+    )
+
+
+def _journal_filters():
+    """Read the date/reference/posted filters of the journal list.
+
+    Returns ``(filters, conditions, params)``; an invalid ``posted`` value is
+    dropped from ``filters`` so it is not echoed back into page links.
+    """
+    filters = {
+        key: request.args.get(key, "").strip()
+        for key in ("date_from", "date_to", "reference", "posted")
+    }
+    conditions, params = entry_filters(
+        filters["date_from"], filters["date_to"], filters["reference"]
+    )
+    if filters["posted"] in ("0", "1"):
+        conditions.append("je.posted = ?")
+        params.append(int(filters["posted"]))
+    else:
+        filters["posted"] = ""
+    return filters, conditions, params
+
+
+@accounting_bp.cli.command("import-journal")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(journal_import.FORMATS),
+              help="Defaults to the file extension.")
+@click.option("--post", is_flag=True, help="Post the imported entries.")
+@click.option("--chunk-size", default=journal_import.DEFAULT_CHUNK_SIZE, show_default=True,
+              help="Entries per transaction.")
+def import_journal_command(path, fmt, post, chunk_size):
+    """Import journal entries from a CSV or JSON Lines file."""
+    fmt = fmt or journal_import.format_for(path)
+    if fmt is None:
+        raise click.UsageError("Cannot tell the format from the file name; pass --format.")
+
+    db = get_db()
+    try:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            report = journal_import.import_journal(
+                db, journal_import.read_rows(f, fmt), post=post, chunk_size=chunk_size
+            )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    finally:
+        db.close()
+
+    click.echo(
+        f"Imported {report.entries} entries ({report.lines} lines, "
+        f"{report.posted} posted) in {report.seconds:.2f}s "
+        f"({report.entries_per_second:.0f} entries/s); {len(report.rejected)} rejected."
+    )
+    for r in report.rejected:
+        click.echo(f"  line {r.line} [{r.reference}]: {r.reason}")
+
+
+@accounting_bp.cli.command("drain-outbox")
+@click.option("--retry-failed", is_flag=True, help="Retry events that failed before.")
+def drain_outbox_command(retry_failed):
+    """Book all pending ledger outbox events as posted journal entries."""
+    db = get_db()
+    if retry_failed:
+        click.echo(f"Retrying {outbox.retry_failed(db)} failed events.")
+    result = outbox.drain_all(db)
+    failed = db.execute(
+        "SELECT id, event, document_id, error FROM ledger_outbox "
+        "WHERE processed_at IS NULL AND error IS NOT NULL ORDER BY id"
+    ).fetchall()
+    db.close()
+
+    click.echo(
+        f"Processed {result.events} events into {result.entries} journal entries "
+        f"in {result.seconds:.3f}s; {result.failed} failed."
+    )
+    for row in failed:
+        click.echo(f"  #{row['id']} {row['event']} {row['document_id']}: {row['error']}")
+
+
+@accounting_bp.cli.command("verify-ledger")
+@click.option("--workers", type=int, help="Worker processes; defaults to the CPU count.")
+@click.option("--chunk-size", default=ledger_verify.DEFAULT_CHUNK_SIZE, show_default=True,
+              help="Journal entries per worker task.")
+@click.option("--report", "report_path", type=click.Path(dir_okay=False, writable=True),
+              help="Write the differences to this CSV file.")
+@click.option("--repair", is_flag=True,
+              help="Reset balances, running balances and entry totals from the lines.")
+def verify_ledger_command(workers, chunk_size, report_path, repair):
+    """Recompute account balances from posted journal lines and report differences."""
+    # Read at call time: scripts point erp.db.DB_PATH at another file
+    report = ledger_verify.verify(erp.db.DB_PATH, workers=workers, chunk_size=chunk_size)
+    click.echo(
+        f"Checked {report.accounts} accounts and {report.entries} entries "
+        f"in {report.chunks} chunks in {report.seconds:.2f}s; "
+        f"{len(report.differences)} differences."
+    )
+    for d in report.differences:
+        if d.kind == "unbalanced_entry":
+            click.echo(f"  {d.kind} #{d.id} [{d.label}]: debits {d.stored} credits {d.actual}")
+        else:
+            click.echo(
+                f"  {d.kind} #{d.id} [{d.label}]: stored {d.stored} "
+                f"actual {d.actual} ({d.delta:+.2f})"
+            )
+    if report_path:
+        ledger_verify.write_report(report, report_path)
+        click.echo(f"Wrote {report_path}.")
+
+    if repair and not report.ok:
+        db = get_db()
+        if db.in_transaction:
+            db.commit()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            ledger_verify.repair(db, report)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        click.echo(f"Repaired {report.repaired} differences.")
+    if len(report.differences) > report.repaired:
+        raise SystemExit(1)
+
+
+@accounting_bp.cli.command("close-period")
+@click.argument("period")
+def close_period_command(period):
+    """Close the books through PERIOD (YYYY-MM) and archive its journal."""
+    db = get_db()
+    try:
+        result = period_close.close_period(db, period)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    finally:
+        db.close()
+    click.echo(
+        f"Closed the books through {result.end_date}: net income "
+        f"{result.net_income:.2f} to Retained Earnings; archived {result.entries} "
+        f"entries ({result.lines} lines) in {result.seconds:.2f}s."
+    )
+
+
 @accounting_bp.route("/journal")
 @login_required
 def journal():
+    filters, conditions, params = _journal_filters()
+
     db = get_db()
-    entries = db.execute(
-        """SELECT je.*,
-                  COALESCE(SUM(jl.debit), 0) AS total_debit,
-                  COALESCE(SUM(jl.credit), 0) AS total_credit
-           FROM journal_entries je
-           LEFT JOIN journal_lines jl ON jl.entry_id = je.id
-           GROUP BY je.id
-           ORDER BY je.entry_date DESC, je.id DESC"""
-    ).fetchall()
+    entries, next_cursor = paginate(
+        db,
+        "SELECT je.* FROM journal_entries je",
+        conditions,
+        params,
+        [("je.entry_date", "entry_date"), ("je.id", "id")],
+        cursor=request.args.get("after"),
+    )
     db.close()
 
-    return render_template("accounting/journal.html", entries=entries)
+    return render_template(
+        "accounting/journal.html",
+        entries=entries,
+        filters=filters,
+        next_cursor=next_cursor,
+    )
 
 
 @accounting_bp.route("/journal/new", methods=["GET", "POST"])
@@ -93,11 +398,13 @@ def journal_new():
         reference = request.form.get("reference", "").strip()
         description = request.form.get("description", "").strip()
 
-        if not entry_date:
-            flash("Entry date is required.", "error")
-            accounts = db.execute(
-                "SELECT * FROM accounts WHERE active = 1 ORDER BY code"
-            ).fetchall()
+        closed = closed_through(db)
+        if not entry_date or (closed and entry_date <= closed):
+            if not entry_date:
+                flash("Entry date is required.", "error")
+            else:
+                flash(f"The books are closed through {closed}; choose a later date.", "error")
+            accounts = active_accounts(db)
             db.close()
             return render_template(
                 "accounting/journal_form.html",
@@ -133,9 +440,7 @@ def journal_new():
 
         if not lines:
             flash("At least one journal line is required.", "error")
-            accounts = db.execute(
-                "SELECT * FROM accounts WHERE active = 1 ORDER BY code"
-            ).fetchall()
+            accounts = active_accounts(db)
             db.close()
             return render_template(
                 "accounting/journal_form.html",
@@ -148,9 +453,7 @@ def journal_new():
                 f"Total debits ({total_debit:.2f}) must equal total credits ({total_credit:.2f}).",
                 "error",
             )
-            accounts = db.execute(
-                "SELECT * FROM accounts WHERE active = 1 ORDER BY code"
-            ).fetchall()
+            accounts = active_accounts(db)
             db.close()
             return render_template(
                 "accounting/journal_form.html",
@@ -159,16 +462,18 @@ def journal_new():
             )
 
         db.execute(
-            "INSERT INTO journal_entries (entry_date, reference, description) VALUES (?, ?, ?)",
-            (entry_date, reference, description),
+            """INSERT INTO journal_entries
+               (entry_date, reference, description, total_debit, total_credit)
+               VALUES (?, ?, ?, ?, ?)""",
+            (entry_date, reference, description,
+             round(total_debit, 2), round(total_credit, 2)),
         )
         entry_id = db.execute("SELECT last_insert_rowid()").fetchone()[0]
 
-        for acct_id, d, c in lines:
-            db.execute(
-                "INSERT INTO journal_lines (entry_id, account_id, debit, credit) VALUES (?, ?, ?, ?)",
-                (entry_id, acct_id, d, c),
-            )
+        insert_lines(
+            db, "journal_lines", "entry_id", entry_id,
+            ("account_id", "debit", "credit"), lines,
+        )
 
         db.commit()
         db.close()
@@ -176,36 +481,88 @@ def journal_new():
         flash("Journal entry created successfully.", "success")
         return redirect(url_for("accounting.journal_detail", id=entry_id))
 
-    accounts = db.execute(
-        "SELECT * FROM accounts WHERE active = 1 ORDER BY code"
-    ).fetchall()
+    accounts = active_accounts(db)
     db.close()
     return render_template(
         "accounting/journal_form.html", accounts=accounts, form={}
     )
 
 
+@accounting_bp.route("/journal/import", methods=["GET", "POST"])
+@login_required
+def journal_import_view():
+    if request.method == "POST":
+        upload = request.files.get("file")
+        fmt = request.form.get("format") or journal_import.format_for(
+            upload.filename if upload else ""
+        )
+        if not upload or not upload.filename:
+            flash("Choose a file to import.", "error")
+            return render_template("accounting/journal_import.html", report=None)
+        if fmt not in journal_import.FORMATS:
+            flash("Cannot tell the file format; choose CSV or JSON Lines.", "error")
+            return render_template("accounting/journal_import.html", report=None)
+
+        sqltrace.mark_batch()
+        db = get_db()
+        try:
+            text = io.TextIOWrapper(upload.stream, encoding="utf-8-sig", newline="")
+            report = journal_import.import_journal(
+                db, journal_import.read_rows(text, fmt),
+                post=bool(request.form.get("post")),
+            )
+        except ValueError as e:
+            flash(f"Import failed: {e}", "error")
+            return render_template("accounting/journal_import.html", report=None)
+        finally:
+            db.close()
+
+        flash(
+            f"Imported {report.entries} journal entries ({report.posted} posted) "
+            f"in {report.seconds:.2f}s.",
+            "success",
+        )
+        if report.rejected:
+            flash(f"{len(report.rejected)} rows or entries were rejected.", "error")
+        return render_template(
+            "accounting/journal_import.html",
+            report=report,
+            rejected=report.rejected[:IMPORT_REJECTIONS_SHOWN],
+        )
+
+    return render_template("accounting/journal_import.html", report=None)
+
+
 @accounting_bp.route("/journal/<int:id>")
 @login_required
 def journal_detail(id):
     db = get_db()
+    schema = "main"
     entry = db.execute(
         "SELECT * FROM journal_entries WHERE id = ?", (id,)
     ).fetchone()
-
-    if not entry:
-        db.close()
-        flash("Journal entry not found.", "error")
-        return redirect(url_for("accounting.journal"))
-
-    lines = db.execute(
-        """SELECT jl.*, a.code AS account_code, a.name AS account_name
-           FROM journal_lines jl
-           JOIN accounts a ON a.id = jl.account_id
-           WHERE jl.entry_id = ?
-           ORDER BY jl.id""",
-        (id,),
-    ).fetchall()
+    if not entry and closed_through(db):
+        # Entries of closed periods live in the archive
+        schema = "archive"
+
+    with attach_archive(db) if schema == "archive" else nullcontext():
+        if schema == "archive":
+            entry = db.execute(
+                "SELECT * FROM archive.journal_entries WHERE id = ?", (id,)
+            ).fetchone()
+        if not entry:
+            db.close()
+            flash("Journal entry not found.", "error")
+            return redirect(url_for("accounting.journal"))
+
+        lines = db.execute(
+            f"""SELECT jl.*, a.code AS account_code, a.name AS account_name
+                FROM {schema}.journal_lines jl
+                JOIN main.accounts a ON a.id = jl.account_id
+                WHERE jl.entry_id = ?
+                ORDER BY jl.id""",
+            (id,),
+        ).fetchall()
     db.close()
 
     return render_template(
@@ -231,48 +588,57 @@ def journal_post(id):
         flash("Journal entry is already posted.", "error")
         return redirect(url_for("accounting.journal_detail", id=id))
 
-    lines = db.execute(
-        """SELECT jl.*, a.account_type
-           FROM journal_lines jl
-           JOIN accounts a ON a.id = jl.account_id
-           WHERE jl.entry_id = ?""",
-        (id,),
-    ).fetchall()
+    closed = closed_through(db)
+    if closed and entry["entry_date"] <= closed:
+        db.close()
+        flash(f"The books are closed through {closed}; this entry cannot be posted.", "error")
+        return redirect(url_for("accounting.journal_detail", id=id))
 
-    for line in lines:
-        acct_type = line["account_type"]
-        debit = line["debit"]
-        credit = line["credit"]
+    if not post_entry(db, id):
+        db.rollback()
+        db.close()
+        flash("Journal entry has no lines or its debits and credits do not balance.", "error")
+        return redirect(url_for("accounting.journal_detail", id=id))
+    db.commit()
+    db.close()
 
-        # Assets and expenses increase with debits, decrease with credits
-        # Liabilities, equity, and revenue increase with credits, decrease with debits
-        if acct_type in ("asset", "expense"):
-            change = debit - credit
-        else:
-            change = credit - debit
+    flash("Journal entry posted successfully.", "success")
+    return redirect(url_for("accounting.journal_detail", id=id))
 
-        db.execute(
-            "UPDATE accounts SET balance = balance + ? WHERE id = ?",
-            (change, line["account_id"]),
-        )
 
-    db.execute(
-        "UPDATE journal_entries SET posted = 1 WHERE id = ?", (id,)
-    )
+@accounting_bp.route("/journal/post-batch", methods=["POST"])
+@login_required
+def journal_post_batch():
+    db = get_db()
+    result = post_entries(db, *entry_filters(
+        request.form.get("date_from", "").strip(),
+        request.form.get("date_to", "").strip(),
+        request.form.get("reference", "").strip(),
+    ))
     db.commit()
     db.close()
 
-    flash("Journal entry posted successfully.", "success")
-    return redirect(url_for("accounting.journal_detail", id=id))
+    flash(
+        f"Posted {result.entries} journal entries in {result.seconds * 1000:.0f} ms "
+        f"({result.entries_per_second:.0f}/s).",
+        "success",
+    )
+    if result.skipped:
+        flash(
+            f"Skipped {result.skipped} entries that have no lines, do not balance "
+            "or are dated in a closed period.",
+            "error",
+        )
+    return redirect(url_for("accounting.journal"))
 
 
 @accounting_bp.route("/trial-balance")
 @login_required
 def trial_balance():
+    as_of = request.args.get("as_of", "")
+
     db = get_db()
-    accounts = db.execute(
-        "SELECT * FROM accounts WHERE active = 1 ORDER BY code"
-    ).fetchall()
+    accounts = account_balances(db, as_of)
     db.close()
 
     rows = []
@@ -317,6 +683,7 @@ def trial_balance():
         rows=rows,
         total_debit=total_debit,
         total_credit=total_credit,
+        as_of=as_of,
     )
 
 
@@ -328,30 +695,10 @@ def profit_loss():
 
     db = get_db()
 
-    # Build a query that sums posted journal line amounts per account
-    # filtered by date range if provided
-    query = """
-        SELECT a.id, a.code, a.name, a.account_type,
-               COALESCE(SUM(jl.debit), 0) AS total_debit,
-               COALESCE(SUM(jl.credit), 0) AS total_credit
-        FROM accounts a
-        LEFT JOIN journal_lines jl ON jl.account_id = a.id
-        LEFT JOIN journal_entries je ON je.id = jl.entry_id AND je.posted = 1
-    """
-    conditions = ["a.account_type IN ('revenue', 'expense')", "a.active = 1"]
-    params = []
-
-    if date_from:
-        conditions.append("(je.entry_date >= ? OR je.entry_date IS NULL)")
-        params.append(date_from)
-    if date_to:
-        conditions.append("(je.entry_date <= ? OR je.entry_date IS NULL)")
-        params.append(date_to)
-
-    query += " WHERE " + " AND ".join(conditions)
-    query += " GROUP BY a.id ORDER BY a.code"
-
-    accounts = db.execute(query, params).fetchall()
+    # Posted totals come from the monthly period_balances buckets, plus raw
+    # lines for the partial months at either end of the range
+    totals = period_totals(db, date_from, date_to)
+    accounts = active_accounts(db, ("revenue", "expense"))
     db.close()
 
     revenue_accounts = []
@@ -360,10 +707,11 @@ def profit_loss():
     total_expense = 0.0
 
     for acct in accounts:
+        total_debit, total_credit = totals.get(acct["id"], (0.0, 0.0))
         # Revenue: credits - debits
         # Expense: debits - credits
         if acct["account_type"] == "revenue":
-            amount = acct["total_credit"] - acct["total_debit"]
+            amount = total_credit - total_debit
             if amount != 0:
                 revenue_accounts.append({
                     "code": acct["code"],
@@ -372,7 +720,7 @@ def profit_loss():
                 })
                 total_revenue += amount
         else:
-            amount = acct["total_debit"] - acct["total_credit"]
+            amount = total_debit - total_credit
             if amount != 0:
                 expense_accounts.append({
                     "code": acct["code"],
@@ -398,12 +746,10 @@ def profit_loss():
 @accounting_bp.route("/balance-sheet")
 @login_required
 def balance_sheet():
+    as_of = request.args.get("as_of", "")
+
     db = get_db()
-    accounts = db.execute(
-        """SELECT * FROM accounts
-           WHERE active = 1 AND account_type IN ('asset', 'liability', 'equity')
-           ORDER BY code"""
-    ).fetchall()
+    accounts = account_balances(db, as_of, ("asset", "liability", "equity"))
     db.close()
 
     asset_accounts = []
@@ -445,4 +791,5 @@ def balance_sheet():
         total_assets=total_assets,
         total_liabilities=total_liabilities,
         total_equity=total_equity,
+        as_of=as_of,
     )
@@ -1,32 +1,79 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required
 from erp.db import get_db
 
 contacts_bp = Blueprint("contacts", __name__, template_folder="../templates")
 
+LOOKUP_LIMIT = 20
+
+# bm25 column weights for contacts_fts/contacts_trigram:
+# name, email, phone, city, tax_id, notes
+_RANK_WEIGHTS = "10.0, 4.0, 4.0, 2.0, 4.0, 1.0"
+
+
+def _fts_phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def search_contacts(db, search, contact_types=None, limit=None):
+    """Ranked full-text search over active contacts.
+
+    Every word of ``search`` must prefix-match a word in some column
+    (contacts_fts); for 3+ character input, substring matches found by the
+    trigram index are appended after the word matches. Best match first.
+    """
+    words = search.split()
+    if not words:
+        return []
+
+    branches = [
+        f"SELECT rowid AS id, 0 AS tier, bm25(contacts_fts, {_RANK_WEIGHTS}) AS score "
+        "FROM contacts_fts WHERE contacts_fts MATCH ?"
+    ]
+    params = [" ".join(_fts_phrase(w) + "*" for w in words)]
+    if len(search) >= 3:
+        branches.append(
+            f"SELECT rowid, 1, bm25(contacts_trigram, {_RANK_WEIGHTS}) "
+            "FROM contacts_trigram WHERE contacts_trigram MATCH ?"
+        )
+        params.append(_fts_phrase(search))
+
+    # MATERIALIZED keeps bm25() inside its FTS query when SQLite would
+    # otherwise flatten a single branch into the outer aggregate.
+    query = (
+        "WITH hits AS MATERIALIZED (" + " UNION ALL ".join(branches) + ") "
+        "SELECT c.* FROM hits JOIN contacts c ON c.id = hits.id WHERE c.active = 1"
+    )
+    if contact_types:
+        query += f" AND c.contact_type IN ({', '.join('?' * len(contact_types))})"
+        params.extend(contact_types)
+    query += " GROUP BY c.id ORDER BY MIN(hits.tier), MIN(hits.score), c.name"
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    return db.execute(query, params).fetchall()
+
 
 @contacts_bp.route("/")
 @login_required
 def index():
     search = request.args.get("search", "").strip()
     contact_type = request.args.get("type", "").strip()
-
-    query = "SELECT * FROM contacts WHERE active = 1"
-    params = []
-
-    if search:
-        query += " AND (name LIKE ? OR email LIKE ? OR phone LIKE ?)"
-        like = f"%{search}%"
-        params.extend([like, like, like])
-
-    if contact_type in ("customer", "supplier", "both"):
-        query += " AND contact_type = ?"
-        params.append(contact_type)
-
-    query += " ORDER BY name"
+    if contact_type not in ("customer", "supplier", "both"):
+        contact_type = ""
 
     db = get_db()
-    contacts = db.execute(query, params).fetchall()
+    if search:
+        contacts = search_contacts(db, search, [contact_type] if contact_type else None)
+    else:
+        query = "SELECT * FROM contacts WHERE active = 1"
+        params = []
+        if contact_type:
+            query += " AND contact_type = ?"
+            params.append(contact_type)
+        query += " ORDER BY name"
+        contacts = db.execute(query, params).fetchall()
     db.close()
 
     return render_template(
@@ -37,6 +84,32 @@ def index():
     )
 
 
+@contacts_bp.route("/lookup")
+@login_required
+def lookup():
+    """Typeahead JSON for contact pickers: ``?q=...&type=customer|supplier``."""
+    q = request.args.get("q", "").strip()
+    wanted = request.args.get("type", "").strip()
+    contact_types = (wanted, "both") if wanted in ("customer", "supplier") else None
+
+    db = get_db()
+    rows = search_contacts(db, q, contact_types, limit=LOOKUP_LIMIT)
+    db.close()
+
+    return jsonify([{"id": r["id"], "name": r["name"], "city": r["city"]} for r in rows])
+
+
+def _payment_terms(form):
+    """Days from the form, None when blank; raises ValueError if invalid."""
+    value = form.get("payment_terms_days", "").strip()
+    if not value:
+        return None
+    days = int(value)
+    if days < 0:
+        raise ValueError(value)
+    return days
+
+
 @contacts_bp.route("/new", methods=["GET", "POST"])
 @login_required
 def new():
@@ -45,6 +118,11 @@ def new():
         if not name:
             flash("Name is required.", "error")
             return render_template("contacts/form.html", contact=request.form, editing=False)
+        try:
+            payment_terms = _payment_terms(request.form)
+        except ValueError:
+            flash("Payment terms must be a whole number of days.", "error")
+            return render_template("contacts/form.html", contact=request.form, editing=False)
 
         contact_type = request.form.get("contact_type", "customer")
         if contact_type not in ("customer", "supplier", "both"):
@@ -52,8 +130,9 @@ def new():
 
         db = get_db()
         db.execute(
-            """INSERT INTO contacts (name, contact_type, email, phone, address, city, country, tax_id, notes)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            """INSERT INTO contacts (name, contact_type, email, phone, address, city, country,
+                                    tax_id, payment_terms_days, notes)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
             (
                 name,
                 contact_type,
@@ -63,6 +142,7 @@ def new():
                 request.form.get("city", "").strip(),
                 request.form.get("country", "").strip(),
                 request.form.get("tax_id", "").strip(),
+                payment_terms,
                 request.form.get("notes", "").strip(),
             ),
         )
@@ -107,6 +187,12 @@ def edit(id):
             flash("Name is required.", "error")
             db.close()
             return render_template("contacts/form.html", contact=request.form, editing=True, id=id)
+        try:
+            payment_terms = _payment_terms(request.form)
+        except ValueError:
+            flash("Payment terms must be a whole number of days.", "error")
+            db.close()
+            return render_template("contacts/form.html", contact=request.form, editing=True, id=id)
 
         contact_type = request.form.get("contact_type", "customer")
         if contact_type not in ("customer", "supplier", "both"):
@@ -115,7 +201,8 @@ def edit(id):
         db.execute(
             """UPDATE contacts
                SET name = ?, contact_type = ?, email = ?, phone = ?,
-                   address = ?, city = ?, country = ?, tax_id = ?, notes = ?
+                   address = ?, city = ?, country = ?, tax_id = ?,
+                   payment_terms_days = ?, notes = ?
                WHERE id = ?""",
             (
                 name,
@@ -126,6 +213,7 @@ def edit(id):
                 request.form.get("city", "").strip(),
                 request.form.get("country", "").strip(),
                 request.form.get("tax_id", "").strip(),
+                payment_terms,
                 request.form.get("notes", "").strip(),
                 id,
             ),
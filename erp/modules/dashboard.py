@@ -1,26 +1,67 @@
+import click
 from flask import Blueprint, render_template
 from flask_login import login_required
 from erp.db import get_db
 
 dashboard_bp = Blueprint("dashboard", __name__, template_folder="../templates")
 
+# Source-of-truth queries for each column of kpi_counters; the triggers
+# from migrations 4 and 15 keep the stored values in step with these.
+KPI_QUERIES = {
+    "total_contacts": "SELECT COUNT(*) FROM contacts",
+    "total_products": "SELECT COUNT(*) FROM products",
+    "total_sales_orders": "SELECT COUNT(*) FROM sales_orders",
+    "total_purchase_orders": "SELECT COUNT(*) FROM purchase_orders",
+    "pending_invoices": (
+        "SELECT COUNT(*) FROM invoices WHERE status IN ('draft', 'sent', 'overdue')"
+    ),
+    "total_revenue": "SELECT COALESCE(SUM(total), 0) FROM invoices WHERE status = 'paid'",
+}
+
+
+def rebuild_kpis(db):
+    """Recompute kpi_counters from scratch.
+
+    Returns ``{name: (stored, actual)}`` for every counter that had drifted.
+    """
+    stored = db.execute("SELECT * FROM kpi_counters WHERE id = 1").fetchone()
+    actual = {name: db.execute(sql).fetchone()[0] for name, sql in KPI_QUERIES.items()}
+
+    drift = {}
+    for name, value in actual.items():
+        old = stored[name] if stored else None
+        if old is None or abs(old - value) > 0.005:
+            drift[name] = (old, value)
+
+    db.execute(
+        f"INSERT OR REPLACE INTO kpi_counters (id, {', '.join(actual)}) "
+        f"VALUES (1, {', '.join('?' * len(actual))})",
+        list(actual.values()),
+    )
+    db.commit()
+    return drift
+
+
+@dashboard_bp.cli.command("rebuild-kpis")
+def rebuild_kpis_command():
+    """Recompute dashboard KPI counters and report any drift."""
+    db = get_db()
+    drift = rebuild_kpis(db)
+    db.close()
+
+    if not drift:
+        click.echo("KPI counters are up to date.")
+    for name, (old, new) in drift.items():
+        click.echo(f"{name}: stored {old}, actual {new}")
+
 
 @dashboard_bp.route("/")
 @login_required
 def index():
     db = get_db()
 
-    # Key stats
-    total_contacts = db.execute("SELECT COUNT(*) FROM contacts").fetchone()[0]
-    total_products = db.execute("SELECT COUNT(*) FROM products").fetchone()[0]
-    total_sales_orders = db.execute("SELECT COUNT(*) FROM sales_orders").fetchone()[0]
-    total_purchase_orders = db.execute("SELECT COUNT(*) FROM purchase_orders").fetchone()[0]
-    pending_invoices = db.execute(
-        "SELECT COUNT(*) FROM invoices WHERE status IN ('draft', 'sent')"
-    ).fetchone()[0]
-    total_revenue = db.execute(
-        "SELECT COALESCE(SUM(total), 0) FROM invoices WHERE status = 'paid'"
-    ).fetchone()[0]
+    # Key stats, maintained by triggers (see KPI_QUERIES)
+    kpis = db.execute("SELECT * FROM kpi_counters WHERE id = 1").fetchone()
 
     # Recent sales orders (last 5)
     recent_sales = db.execute(
@@ -44,12 +85,12 @@ def index():
 
     return render_template(
         "dashboard/index.html",
-        total_contacts=total_contacts,
-        total_products=total_products,
-        total_sales_orders=total_sales_orders,
-        total_purchase_orders=total_purchase_orders,
-        pending_invoices=pending_invoices,
-        total_revenue=total_revenue,
+        total_contacts=kpis["total_contacts"],
+        total_products=kpis["total_products"],
+        total_sales_orders=kpis["total_sales_orders"],
+        total_purchase_orders=kpis["total_purchase_orders"],
+        pending_invoices=kpis["pending_invoices"],
+        total_revenue=kpis["total_revenue"],
         recent_sales=recent_sales,
         recent_purchases=recent_purchases,
     )
@@ -1,19 +1,19 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required
 from erp.db import get_db
+from erp.sequences import DocumentSequence
 
 hr_bp = Blueprint("hr", __name__, template_folder="../templates")
 
+# Employee numbers stay EMP-0001 style whatever DOCUMENT_NUMBER_FORMAT says
+EMPLOYEE_NUMBERS = DocumentSequence(
+    "EMP", "employees", "employee_number", fmt="{prefix}-{seq:04d}"
+)
+
 
 def _generate_employee_number(db):
     """Auto-generate the next employee number like EMP-0001."""
-    row = db.execute(
-        "SELECT employee_number FROM employees ORDER BY id DESC LIMIT 1"
-    ).fetchone()
-    if row:
-        last_num = int(row["employee_number"].split("-")[1])
-        return f"EMP-{last_num + 1:04d}"
-    return "EMP-0001"
+    return EMPLOYEE_NUMBERS.next(db)
 
 
 @hr_bp.route("/")
@@ -1,11 +1,17 @@
 import sqlite3
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import (
+    Blueprint, Response, render_template, request, redirect, url_for, flash, jsonify,
+)
 from flask_login import login_required
+from erp import catalog
 from erp.db import get_db
 
 products_bp = Blueprint("products", __name__, template_folder="../templates")
 
+# A versioned catalog URL never changes content, so the browser may keep it
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
 
 @products_bp.route("/")
 @login_required
@@ -21,6 +27,43 @@ def index():
     return render_template("products/index.html", products=products)
 
 
+@products_bp.route("/catalog.json")
+@login_required
+def catalog_json():
+    """Active products as JSON for the order forms: ``?fields=id,name,...&v=``.
+
+    Serialized once per catalog version; honours If-None-Match and gzip.
+    """
+    try:
+        fields = catalog.parse_fields(request.args.get("fields", ""))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    db = get_db()
+    entry = catalog.get(db, fields)
+    db.close()
+
+    gzipped = request.accept_encodings["gzip"] > 0
+    etag = entry.etag + ("-gzip" if gzipped else "")
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(entry.gzipped if gzipped else entry.body,
+                            mimetype="application/json")
+        if gzipped:
+            response.headers["Content-Encoding"] = "gzip"
+    response.set_etag(etag)
+    response.vary.add("Accept-Encoding")
+    if request.args.get("v") == str(entry.version):
+        response.cache_control.private = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response
+
+
 @products_bp.route("/new", methods=["GET", "POST"])
 @login_required
 def new():
@@ -1,66 +1,33 @@
-import json
+from datetime import date
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required
+from erp import catalog, outbox
 from erp.db import get_db
+from erp.line_items import ORDER_LINE_COLUMNS, insert_lines, parse_order_lines
+from erp.sequences import DocumentSequence
 
 purchasing_bp = Blueprint("purchasing", __name__, template_folder="../templates")
 
+# Product fields the PO form fetches from /products/catalog.json
+CATALOG_FIELDS = ("id", "sku", "name", "cost_price")
 
-def _next_po_number(db):
-    row = db.execute(
-        "SELECT po_number FROM purchase_orders ORDER BY id DESC LIMIT 1"
-    ).fetchone()
-    if row:
-        last_num = int(row["po_number"].split("-")[1])
-        return f"PO-{last_num + 1:04d}"
-    return "PO-0001"
-
-
-def _get_suppliers(db):
-    return db.execute(
-        "SELECT id, name FROM contacts "
-        "WHERE contact_type IN ('supplier','both') AND active = 1 "
-        "ORDER BY name"
-    ).fetchall()
+PO_NUMBERS = DocumentSequence("PO", "purchase_orders", "po_number")
 
 
-def _get_products(db):
-    return db.execute(
-        "SELECT id, name, sku, cost_price FROM products WHERE active = 1 ORDER BY name"
-    ).fetchall()
+def _next_po_number(db):
+    return PO_NUMBERS.next(db)
 
 
-def _products_json(products):
-    return json.dumps(
-        {str(p["id"]): {"name": p["name"], "sku": p["sku"], "cost_price": p["cost_price"]} for p in products}
-    )
+def _catalog_url(db):
+    return catalog.url(db, CATALOG_FIELDS)
 
 
 def _save_po(db, po_id, supplier_id, order_date, expected_date, notes, form):
-    product_ids = form.getlist("product_id[]")
-    quantities = form.getlist("quantity[]")
-    unit_prices = form.getlist("unit_price[]")
+    lines, (subtotal, tax_amount, total) = parse_order_lines(form)
 
     # Delete old lines if editing
     db.execute("DELETE FROM purchase_order_lines WHERE po_id = ?", (po_id,))
-
-    subtotal = 0.0
-    for pid, qty, price in zip(product_ids, quantities, unit_prices):
-        if not pid:
-            continue
-        qty = float(qty or 0)
-        price = float(price or 0)
-        line_total = round(qty * price, 2)
-        subtotal += line_total
-        db.execute(
-            "INSERT INTO purchase_order_lines (po_id, product_id, quantity, unit_price, line_total) "
-            "VALUES (?, ?, ?, ?, ?)",
-            (po_id, int(pid), qty, price, line_total),
-        )
-
-    subtotal = round(subtotal, 2)
-    tax_amount = round(subtotal * 0.10, 2)
-    total = round(subtotal + tax_amount, 2)
+    insert_lines(db, "purchase_order_lines", "po_id", po_id, ORDER_LINE_COLUMNS, lines)
 
     db.execute(
         "UPDATE purchase_orders SET supplier_id = ?, order_date = ?, expected_date = ?, "
@@ -88,8 +55,7 @@ def index():
 @login_required
 def new():
     db = get_db()
-    suppliers = _get_suppliers(db)
-    products = _get_products(db)
+    catalog_url = _catalog_url(db)
 
     if request.method == "POST":
         supplier_id = request.form.get("supplier_id", "").strip()
@@ -101,9 +67,7 @@ def new():
             return render_template(
                 "purchasing/form.html",
                 po=None,
-                suppliers=suppliers,
-                products=products,
-                products_json=_products_json(products),
+                catalog_url=catalog_url,
                 editing=False,
             )
 
@@ -128,9 +92,7 @@ def new():
     return render_template(
         "purchasing/form.html",
         po=None,
-        suppliers=suppliers,
-        products=products,
-        products_json=_products_json(products),
+        catalog_url=catalog_url,
         editing=False,
     )
 
@@ -169,7 +131,13 @@ def detail(id):
 @login_required
 def edit(id):
     db = get_db()
-    po = db.execute("SELECT * FROM purchase_orders WHERE id = ?", (id,)).fetchone()
+    po = db.execute(
+        "SELECT po.*, c.name AS supplier_name "
+        "FROM purchase_orders po "
+        "JOIN contacts c ON po.supplier_id = c.id "
+        "WHERE po.id = ?",
+        (id,),
+    ).fetchone()
 
     if not po:
         db.close()
@@ -181,8 +149,7 @@ def edit(id):
         flash("Only draft purchase orders can be edited.", "error")
         return redirect(url_for("purchasing.detail", id=id))
 
-    suppliers = _get_suppliers(db)
-    products = _get_products(db)
+    catalog_url = _catalog_url(db)
 
     if request.method == "POST":
         supplier_id = request.form.get("supplier_id", "").strip()
@@ -191,7 +158,7 @@ def edit(id):
         if not supplier_id or not order_date:
             flash("Supplier and order date are required.", "error")
             lines = db.execute(
-                "SELECT pol.*, p.name AS product_name "
+                "SELECT pol.*, p.name AS product_name, p.sku "
                 "FROM purchase_order_lines pol "
                 "JOIN products p ON pol.product_id = p.id "
                 "WHERE pol.po_id = ? ORDER BY pol.id",
@@ -202,9 +169,7 @@ def edit(id):
                 "purchasing/form.html",
                 po=po,
                 lines=lines,
-                suppliers=suppliers,
-                products=products,
-                products_json=_products_json(products),
+                catalog_url=catalog_url,
                 editing=True,
             )
 
@@ -218,7 +183,7 @@ def edit(id):
         return redirect(url_for("purchasing.detail", id=id))
 
     lines = db.execute(
-        "SELECT pol.*, p.name AS product_name "
+        "SELECT pol.*, p.name AS product_name, p.sku "
         "FROM purchase_order_lines pol "
         "JOIN products p ON pol.product_id = p.id "
         "WHERE pol.po_id = ? ORDER BY pol.id",
@@ -230,9 +195,7 @@ def edit(id):
         "purchasing/form.html",
         po=po,
         lines=lines,
-        suppliers=suppliers,
-        products=products,
-        products_json=_products_json(products),
+        catalog_url=catalog_url,
         editing=True,
     )
 
@@ -295,6 +258,10 @@ def receive(id):
         )
 
     db.execute("UPDATE purchase_orders SET status = 'received' WHERE id = ?", (id,))
+    outbox.enqueue(
+        db, "po_received", id, date.today().isoformat(), po["po_number"],
+        po["subtotal"], po["tax_amount"], po["total"],
+    )
     db.commit()
     db.close()
 
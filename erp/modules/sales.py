@@ -1,78 +1,112 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+import csv
+import io
+
+import click
+from flask import (
+    Blueprint, Response, current_app, render_template, request, redirect, url_for, flash,
+    stream_with_context,
+)
 from flask_login import login_required
+from erp import catalog, invoicing, outbox, overdue, payments, sqltrace
 from erp.db import get_db
-import json
+from erp.line_items import ORDER_LINE_COLUMNS, insert_lines, parse_order_lines
+from erp.pagination import paginate
+from erp.sequences import DocumentSequence
 from datetime import date
 
 sales_bp = Blueprint("sales", __name__, template_folder="../templates")
 
+ORDER_STATUSES = ("draft", "confirmed", "shipped", "invoiced", "cancelled")
+INVOICE_STATUSES = ("draft", "sent", "paid", "overdue", "cancelled")
+PAYMENT_STATUSES = ("unmatched", "partial", "matched")
+
+# Product fields the order form fetches from /products/catalog.json
+CATALOG_FIELDS = ("id", "name", "unit_price")
+
+ORDER_NUMBERS = DocumentSequence("SO", "sales_orders", "order_number")
+INVOICE_NUMBERS = DocumentSequence("INV", "invoices", "invoice_number")
+
+# (column, label, first day past due, last day past due)
+AGING_BUCKETS = (
+    ("current", "Current", None, 0),
+    ("days_1_30", "1-30 Days", 1, 30),
+    ("days_31_60", "31-60 Days", 31, 60),
+    ("days_61_90", "61-90 Days", 61, 90),
+    ("days_over_90", "Over 90 Days", 91, None),
+)
+CSV_CHUNK_ROWS = 1000
+IMPORT_REJECTIONS_SHOWN = 200
+
+# Unpaid invoices, read from the covering partial index idx_invoices_open
+# only (the planner would otherwise pick idx_invoices_status). The status
+# list must match the index's WHERE clause word for word.
+OPEN_INVOICES = """SELECT id, customer_id, due_date, invoice_date,
+           total - amount_paid AS open_amount,
+           CAST(julianday(?) - julianday(COALESCE(due_date, invoice_date)) AS INTEGER)
+               AS days_past_due
+    FROM invoices INDEXED BY idx_invoices_open
+    WHERE status IN ('draft', 'sent', 'overdue') AND total - amount_paid > 0.005"""
+
 
 def _next_order_number(db):
-    row = db.execute(
-        "SELECT order_number FROM sales_orders ORDER BY id DESC LIMIT 1"
-    ).fetchone()
-    if row:
-        seq = int(row["order_number"].split("-")[1]) + 1
-    else:
-        seq = 1
-    return f"SO-{seq:04d}"
+    return ORDER_NUMBERS.next(db)
 
 
 def _next_invoice_number(db):
-    row = db.execute(
-        "SELECT invoice_number FROM invoices ORDER BY id DESC LIMIT 1"
-    ).fetchone()
-    if row:
-        seq = int(row["invoice_number"].split("-")[1]) + 1
-    else:
-        seq = 1
-    return f"INV-{seq:04d}"
+    return INVOICE_NUMBERS.next(db)
 
 
-def _get_customers(db):
-    return db.execute(
-        "SELECT id, name FROM contacts WHERE active = 1 "
-        "AND contact_type IN ('customer', 'both') ORDER BY name"
-    ).fetchall()
+def _customer_name(db, customer_id):
+    """Name shown in the customer picker for a preselected id."""
+    if not customer_id:
+        return None
+    row = db.execute(
+        "SELECT name FROM contacts WHERE id = ?", (customer_id,)
+    ).fetchone()
+    return row["name"] if row else None
 
 
-def _get_products(db):
-    return db.execute(
-        "SELECT id, name, unit_price FROM products WHERE active = 1 ORDER BY name"
-    ).fetchall()
+def _catalog_url(db):
+    return catalog.url(db, CATALOG_FIELDS)
 
 
-def _save_order_lines(db, order_id, form):
-    """Parse line item arrays from form and insert into sales_order_lines."""
-    product_ids = form.getlist("product_id[]")
-    quantities = form.getlist("quantity[]")
-    unit_prices = form.getlist("unit_price[]")
+def _list_filters(alias, statuses):
+    """Read the status/customer/created-date filters of a list view.
 
-    subtotal = 0.0
-    for i in range(len(product_ids)):
-        pid = product_ids[i]
-        qty = quantities[i]
-        price = unit_prices[i]
+    Returns ``(filters, conditions, params)``; invalid values are dropped
+    from ``filters`` so they are not echoed back into page links.
+    """
+    filters = {
+        key: request.args.get(key, "").strip()
+        for key in ("status", "customer_id", "date_from", "date_to")
+    }
+    conditions = []
+    params = []
 
-        if not pid or not qty or not price:
-            continue
+    if filters["status"] in statuses:
+        conditions.append(f"{alias}.status = ?")
+        params.append(filters["status"])
+    else:
+        filters["status"] = ""
+    if filters["customer_id"].isdigit():
+        conditions.append(f"{alias}.customer_id = ?")
+        params.append(int(filters["customer_id"]))
+    else:
+        filters["customer_id"] = ""
+    if filters["date_from"]:
+        conditions.append(f"{alias}.created_at >= ?")
+        params.append(filters["date_from"])
+    if filters["date_to"]:
+        conditions.append(f"{alias}.created_at < date(?, '+1 day')")
+        params.append(filters["date_to"])
 
-        pid = int(pid)
-        qty = float(qty)
-        price = float(price)
-        line_total = qty * price
-        subtotal += line_total
+    return filters, conditions, params
 
-        db.execute(
-            """INSERT INTO sales_order_lines
-               (order_id, product_id, quantity, unit_price, line_total)
-               VALUES (?, ?, ?, ?, ?)""",
-            (order_id, pid, qty, price, line_total),
-        )
 
-    tax_amount = round(subtotal * 0.1, 2)
-    total = round(subtotal + tax_amount, 2)
-    subtotal = round(subtotal, 2)
+def _save_order_lines(db, order_id, form):
+    """Parse line item arrays from form and insert into sales_order_lines."""
+    lines, (subtotal, tax_amount, total) = parse_order_lines(form)
+    insert_lines(db, "sales_order_lines", "order_id", order_id, ORDER_LINE_COLUMNS, lines)
 
     db.execute(
         "UPDATE sales_orders SET subtotal = ?, tax_amount = ?, total = ? WHERE id = ?",
@@ -89,15 +123,29 @@ def _save_order_lines(db, order_id, form):
 @sales_bp.route("/")
 @login_required
 def index():
+    filters, conditions, params = _list_filters("so", ORDER_STATUSES)
+
     db = get_db()
-    orders = db.execute(
+    orders, next_cursor = paginate(
+        db,
         "SELECT so.*, c.name AS customer_name "
         "FROM sales_orders so "
-        "JOIN contacts c ON so.customer_id = c.id "
-        "ORDER BY so.created_at DESC"
-    ).fetchall()
+        "JOIN contacts c ON so.customer_id = c.id",
+        conditions,
+        params,
+        [("so.created_at", "created_at"), ("so.id", "id")],
+        cursor=request.args.get("after"),
+    )
+    customer_name = _customer_name(db, filters["customer_id"])
     db.close()
-    return render_template("sales/index.html", orders=orders)
+    return render_template(
+        "sales/index.html",
+        orders=orders,
+        customer_name=customer_name,
+        statuses=ORDER_STATUSES,
+        filters=filters,
+        next_cursor=next_cursor,
+    )
 
 
 @sales_bp.route("/new", methods=["GET", "POST"])
@@ -112,15 +160,12 @@ def new():
 
         if not customer_id:
             flash("Customer is required.", "error")
-            customers = _get_customers(db)
-            products = _get_products(db)
+            catalog_url = _catalog_url(db)
             db.close()
             return render_template(
                 "sales/form.html",
                 order=None,
-                customers=customers,
-                products=products,
-                products_json=json.dumps([dict(p) for p in products]),
+                catalog_url=catalog_url,
                 editing=False,
             )
 
@@ -142,16 +187,13 @@ def new():
         flash("Sales order created successfully.", "success")
         return redirect(url_for("sales.detail", id=order_id))
 
-    customers = _get_customers(db)
-    products = _get_products(db)
+    catalog_url = _catalog_url(db)
     db.close()
 
     return render_template(
         "sales/form.html",
         order=None,
-        customers=customers,
-        products=products,
-        products_json=json.dumps([dict(p) for p in products]),
+        catalog_url=catalog_url,
         editing=False,
     )
 
@@ -189,7 +231,13 @@ def detail(id):
 @login_required
 def edit(id):
     db = get_db()
-    order = db.execute("SELECT * FROM sales_orders WHERE id = ?", (id,)).fetchone()
+    order = db.execute(
+        "SELECT so.*, c.name AS customer_name "
+        "FROM sales_orders so "
+        "JOIN contacts c ON so.customer_id = c.id "
+        "WHERE so.id = ?",
+        (id,),
+    ).fetchone()
 
     if not order:
         db.close()
@@ -208,8 +256,7 @@ def edit(id):
 
         if not customer_id:
             flash("Customer is required.", "error")
-            customers = _get_customers(db)
-            products = _get_products(db)
+            catalog_url = _catalog_url(db)
             lines = db.execute(
                 "SELECT sol.*, p.name AS product_name "
                 "FROM sales_order_lines sol "
@@ -221,9 +268,7 @@ def edit(id):
             return render_template(
                 "sales/form.html",
                 order=order,
-                customers=customers,
-                products=products,
-                products_json=json.dumps([dict(p) for p in products]),
+                catalog_url=catalog_url,
                 lines=lines,
                 editing=True,
             )
@@ -243,8 +288,7 @@ def edit(id):
         flash("Sales order updated successfully.", "success")
         return redirect(url_for("sales.detail", id=id))
 
-    customers = _get_customers(db)
-    products = _get_products(db)
+    catalog_url = _catalog_url(db)
     lines = db.execute(
         "SELECT sol.*, p.name AS product_name "
         "FROM sales_order_lines sol "
@@ -257,9 +301,7 @@ def edit(id):
     return render_template(
         "sales/form.html",
         order=order,
-        customers=customers,
-        products=products,
-        products_json=json.dumps([dict(p) for p in products]),
+        catalog_url=catalog_url,
         lines=lines,
         editing=True,
     )
@@ -324,15 +366,29 @@ def cancel(id):
 @sales_bp.route("/invoices")
 @login_required
 def invoices():
+    filters, conditions, params = _list_filters("inv", INVOICE_STATUSES)
+
     db = get_db()
-    invoice_list = db.execute(
+    invoice_list, next_cursor = paginate(
+        db,
         "SELECT inv.*, c.name AS customer_name "
         "FROM invoices inv "
-        "JOIN contacts c ON inv.customer_id = c.id "
-        "ORDER BY inv.created_at DESC"
-    ).fetchall()
+        "JOIN contacts c ON inv.customer_id = c.id",
+        conditions,
+        params,
+        [("inv.created_at", "created_at"), ("inv.id", "id")],
+        cursor=request.args.get("after"),
+    )
+    customer_name = _customer_name(db, filters["customer_id"])
     db.close()
-    return render_template("sales/invoices.html", invoices=invoice_list)
+    return render_template(
+        "sales/invoices.html",
+        invoices=invoice_list,
+        customer_name=customer_name,
+        statuses=INVOICE_STATUSES,
+        filters=filters,
+        next_cursor=next_cursor,
+    )
 
 
 @sales_bp.route("/<int:id>/create-invoice", methods=["POST"])
@@ -351,18 +407,32 @@ def create_invoice(id):
         flash("Only confirmed or shipped orders can be invoiced.", "error")
         return redirect(url_for("sales.detail", id=id))
 
+    # Same rule as the invoice run: never bill an order twice
+    if not db.execute(
+        f"SELECT 1 FROM sales_orders so WHERE so.id = ? AND {invoicing.NOT_INVOICED}",
+        (id,),
+    ).fetchone():
+        db.close()
+        flash("This order has already been invoiced.", "error")
+        return redirect(url_for("sales.detail", id=id))
+
     invoice_number = _next_invoice_number(db)
+    invoice_date = date.today().isoformat()
 
     db.execute(
         """INSERT INTO invoices
-           (invoice_number, sales_order_id, customer_id, invoice_date,
+           (invoice_number, sales_order_id, customer_id, invoice_date, due_date,
             status, subtotal, tax_amount, total, notes)
-           VALUES (?, ?, ?, ?, 'draft', ?, ?, ?, ?)""",
+           VALUES (?, ?, ?, ?, ?, 'draft', ?, ?, ?, ?)""",
         (
             invoice_number,
             id,
             order["customer_id"],
-            date.today().isoformat(),
+            invoice_date,
+            overdue.due_date(
+                db, order["customer_id"], invoice_date,
+                current_app.config["DEFAULT_PAYMENT_TERMS_DAYS"],
+            ),
             order["subtotal"],
             order["tax_amount"],
             order["total"],
@@ -370,26 +440,19 @@ def create_invoice(id):
         ),
     )
     invoice_id = db.execute("SELECT last_insert_rowid()").fetchone()[0]
+    outbox.enqueue(
+        db, "invoice_created", invoice_id, invoice_date, invoice_number,
+        order["subtotal"], order["tax_amount"], order["total"],
+    )
 
     # Copy lines from sales order to invoice
-    lines = db.execute(
-        "SELECT * FROM sales_order_lines WHERE order_id = ?", (id,)
-    ).fetchall()
-    for line in lines:
-        db.execute(
-            """INSERT INTO invoice_lines
-               (invoice_id, product_id, description, quantity, unit_price, tax_rate, line_total)
-               VALUES (?, ?, ?, ?, ?, ?, ?)""",
-            (
-                invoice_id,
-                line["product_id"],
-                line["description"],
-                line["quantity"],
-                line["unit_price"],
-                line["tax_rate"],
-                line["line_total"],
-            ),
-        )
+    db.execute(
+        """INSERT INTO invoice_lines
+           (invoice_id, product_id, description, quantity, unit_price, tax_rate, line_total)
+           SELECT ?, product_id, description, quantity, unit_price, tax_rate, line_total
+           FROM sales_order_lines WHERE order_id = ? ORDER BY id""",
+        (invoice_id, id),
+    )
 
     # Update sales order status
     db.execute(
@@ -403,6 +466,96 @@ def create_invoice(id):
     return redirect(url_for("sales.invoice_detail", id=invoice_id))
 
 
+def _invoice_run_filters(source):
+    """Read the bulk invoicing filters from ``source`` (form or query args).
+
+    Returns ``(filters, conditions, params)`` like _list_filters.
+    """
+    filters = {
+        key: source.get(key, "").strip()
+        for key in ("status", "customer_id", "date_from", "date_to")
+    }
+    if filters["status"] not in invoicing.INVOICEABLE_STATUSES:
+        filters["status"] = ""
+    if not filters["customer_id"].isdigit():
+        filters["customer_id"] = ""
+    conditions, params = invoicing.order_filters(**filters)
+    return filters, conditions, params
+
+
+@sales_bp.route("/invoice-run", methods=["GET", "POST"])
+@login_required
+def invoice_run():
+    source = request.form if request.method == "POST" else request.args
+    filters, conditions, params = _invoice_run_filters(source)
+
+    db = get_db()
+    if request.method == "POST":
+        result = invoicing.invoice_orders(
+            db, INVOICE_NUMBERS, conditions, params,
+            terms_days=current_app.config["DEFAULT_PAYMENT_TERMS_DAYS"],
+        )
+        db.close()
+        if not result.orders:
+            flash("No orders to invoice.", "error")
+            return redirect(url_for("sales.invoice_run", **filters))
+        flash(
+            f"Invoiced {result.orders} orders ({result.first_number} to "
+            f"{result.last_number}) in {result.seconds:.2f}s "
+            f"({result.orders_per_second:.0f} orders/s).",
+            "success",
+        )
+        return redirect(url_for("sales.invoices"))
+
+    pending = invoicing.count_orders(db, conditions, params)
+    customer_name = _customer_name(db, filters["customer_id"])
+    db.close()
+    return render_template(
+        "sales/invoice_run.html",
+        filters=filters,
+        customer_name=customer_name,
+        statuses=invoicing.INVOICEABLE_STATUSES,
+        pending=pending,
+    )
+
+
+@sales_bp.cli.command("invoice-orders")
+@click.option("--customer", "customer_id", type=int, help="Only orders of this customer id.")
+@click.option("--from", "date_from", help="Earliest order date (YYYY-MM-DD).")
+@click.option("--to", "date_to", help="Latest order date (YYYY-MM-DD).")
+@click.option("--status", type=click.Choice(invoicing.INVOICEABLE_STATUSES),
+              help="Only orders in this status (default: both).")
+@click.option("--invoice-date", help="Date of the invoices (default: today).")
+@click.option("--chunk-size", default=invoicing.DEFAULT_CHUNK_SIZE, show_default=True,
+              help="Orders per transaction.")
+def invoice_orders_command(customer_id, date_from, date_to, status, invoice_date, chunk_size):
+    """Invoice all confirmed and shipped sales orders matching the filters.
+
+    Safe to re-run after an interruption: it continues with the orders left.
+    """
+    if invoice_date:
+        try:
+            date.fromisoformat(invoice_date)
+        except ValueError:
+            raise click.BadParameter("must be YYYY-MM-DD", param_hint="--invoice-date")
+    conditions, params = invoicing.order_filters(customer_id, date_from, date_to, status)
+    db = get_db()
+    result = invoicing.invoice_orders(
+        db, INVOICE_NUMBERS, conditions, params, invoice_date=invoice_date,
+        terms_days=current_app.config["DEFAULT_PAYMENT_TERMS_DAYS"],
+        chunk_size=chunk_size,
+    )
+    db.close()
+    if not result.orders:
+        click.echo("No orders to invoice.")
+        return
+    click.echo(
+        f"Invoiced {result.orders} orders ({result.lines} lines, {result.chunks} chunks, "
+        f"{result.first_number} to {result.last_number}) in {result.seconds:.3f}s "
+        f"({result.orders_per_second:.0f} orders/s)."
+    )
+
+
 @sales_bp.route("/invoices/<int:id>")
 @login_required
 def invoice_detail(id):
@@ -427,9 +580,52 @@ def invoice_detail(id):
         "WHERE il.invoice_id = ?",
         (id,),
     ).fetchall()
+    allocations = db.execute(
+        "SELECT pa.amount, p.id AS payment_id, p.payment_date, p.reference "
+        "FROM payment_allocations pa "
+        "JOIN payments p ON pa.payment_id = p.id "
+        "WHERE pa.invoice_id = ? "
+        "ORDER BY p.payment_date, pa.id",
+        (id,),
+    ).fetchall()
     db.close()
 
-    return render_template("sales/invoice_detail.html", invoice=invoice, lines=lines)
+    return render_template(
+        "sales/invoice_detail.html", invoice=invoice, lines=lines, allocations=allocations
+    )
+
+
+@sales_bp.route("/invoices/<int:id>/mark-sent", methods=["POST"])
+@login_required
+def mark_sent(id):
+    db = get_db()
+    invoice = db.execute("SELECT status FROM invoices WHERE id = ?", (id,)).fetchone()
+
+    if not invoice:
+        db.close()
+        flash("Invoice not found.", "error")
+        return redirect(url_for("sales.invoices"))
+
+    if invoice["status"] != "draft":
+        db.close()
+        flash("Only draft invoices can be marked as sent.", "error")
+        return redirect(url_for("sales.invoice_detail", id=id))
+
+    db.execute("UPDATE invoices SET status = 'sent' WHERE id = ?", (id,))
+    db.commit()
+    db.close()
+
+    flash("Invoice marked as sent.", "success")
+    return redirect(url_for("sales.invoice_detail", id=id))
+
+
+@sales_bp.cli.command("sweep-overdue")
+def sweep_overdue_command():
+    """Mark sent invoices past their due date as overdue."""
+    db = get_db()
+    moved = overdue.sweep(db)
+    db.close()
+    click.echo(f"Marked {moved} invoices overdue.")
 
 
 @sales_bp.route("/invoices/<int:id>/mark-paid", methods=["POST"])
@@ -452,8 +648,233 @@ def mark_paid(id):
         "UPDATE invoices SET status = 'paid', amount_paid = total WHERE id = ?",
         (id,),
     )
+    # Payments allocated from bank statements are already booked
+    outstanding = invoice["total"] - invoice["amount_paid"]
+    outbox.enqueue(
+        db, "invoice_paid", id, date.today().isoformat(), invoice["invoice_number"],
+        outstanding, 0.0, outstanding,
+    )
     db.commit()
     db.close()
 
     flash("Invoice marked as paid.", "success")
     return redirect(url_for("sales.invoice_detail", id=id))
+
+
+@sales_bp.route("/payments")
+@login_required
+def payment_list():
+    status = request.args.get("status", "").strip()
+    conditions = []
+    params = []
+    if status in PAYMENT_STATUSES:
+        conditions.append("p.status = ?")
+        params.append(status)
+    else:
+        status = ""
+
+    db = get_db()
+    payment_rows, next_cursor = paginate(
+        db,
+        "SELECT p.*, c.name AS customer_name "
+        "FROM payments p "
+        "LEFT JOIN contacts c ON p.customer_id = c.id",
+        conditions,
+        params,
+        [("p.created_at", "created_at"), ("p.id", "id")],
+        cursor=request.args.get("after"),
+    )
+    db.close()
+    return render_template(
+        "sales/payments.html",
+        payments=payment_rows,
+        statuses=PAYMENT_STATUSES,
+        status=status,
+        next_cursor=next_cursor,
+    )
+
+
+def _import_message(report):
+    return (
+        f"Imported {report.payments} payments (${report.amount:.2f}) in "
+        f"{report.seconds:.2f}s: {report.matched} matched, {report.partial} partly "
+        f"allocated, {report.unmatched} unmatched; {report.invoices_paid} invoices "
+        f"paid in full, {report.duplicates} already imported."
+    )
+
+
+@sales_bp.route("/payments/import", methods=["GET", "POST"])
+@login_required
+def payment_import():
+    if request.method == "POST":
+        upload = request.files.get("file")
+        fmt = request.form.get("format") or payments.format_for(
+            upload.filename if upload else ""
+        )
+        if not upload or not upload.filename:
+            flash("Choose a file to import.", "error")
+            return render_template("sales/payment_import.html", report=None)
+        if fmt not in payments.FORMATS:
+            flash("Cannot tell the file format; choose CSV or camt XML.", "error")
+            return render_template("sales/payment_import.html", report=None)
+
+        sqltrace.mark_batch()
+        db = get_db()
+        try:
+            stream = upload.stream
+            if fmt == "csv":
+                stream = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+            report = payments.import_payments(db, payments.read_statement(stream, fmt))
+        except ValueError as e:
+            flash(f"Import failed: {e}", "error")
+            return render_template("sales/payment_import.html", report=None)
+        finally:
+            db.close()
+
+        flash(_import_message(report), "success")
+        if report.rejected:
+            flash(f"{len(report.rejected)} rows were rejected.", "error")
+        return render_template(
+            "sales/payment_import.html",
+            report=report,
+            rejected=report.rejected[:IMPORT_REJECTIONS_SHOWN],
+        )
+
+    return render_template("sales/payment_import.html", report=None)
+
+
+@sales_bp.cli.command("import-payments")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(payments.FORMATS),
+              help="Defaults to the file extension.")
+@click.option("--batch-size", default=payments.DEFAULT_BATCH_SIZE, show_default=True,
+              help="Payments per batch of writes.")
+def import_payments_command(path, fmt, batch_size):
+    """Import customer payments from a bank statement (CSV or camt XML)."""
+    fmt = fmt or payments.format_for(path)
+    if fmt is None:
+        raise click.UsageError("Cannot tell the format from the file name; pass --format.")
+
+    db = get_db()
+    try:
+        if fmt == "csv":
+            f = open(path, encoding="utf-8-sig", newline="")
+        else:
+            f = open(path, "rb")
+        with f:
+            report = payments.import_payments(
+                db, payments.read_statement(f, fmt), batch_size=batch_size
+            )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    finally:
+        db.close()
+
+    click.echo(
+        f"{_import_message(report)} {report.payments_per_second:.0f} payments/s; "
+        f"{len(report.rejected)} rejected."
+    )
+    for r in report.rejected:
+        click.echo(f"  line {r.line} [{r.reference}]: {r.reason}")
+
+
+def _aging_bucket(days):
+    for column, _, first, last in AGING_BUCKETS:
+        if (first is None or days >= first) and (last is None or days <= last):
+            return column
+
+
+def _aging_as_of():
+    as_of = request.args.get("as_of", "").strip()
+    try:
+        return date.fromisoformat(as_of).isoformat()
+    except ValueError:
+        return date.today().isoformat()
+
+
+@sales_bp.route("/invoices/aging")
+@login_required
+def aging():
+    as_of = _aging_as_of()
+    sums = []
+    for column, _, first, last in AGING_BUCKETS:
+        bounds = []
+        if first is not None:
+            bounds.append(f"o.days_past_due >= {first}")
+        if last is not None:
+            bounds.append(f"o.days_past_due <= {last}")
+        sums.append(
+            f"SUM(CASE WHEN {' AND '.join(bounds)} THEN o.open_amount ELSE 0 END) AS {column}"
+        )
+
+    db = get_db()
+    rows = db.execute(
+        f"""SELECT o.customer_id, c.name AS customer_name, COUNT(*) AS invoices,
+                   {', '.join(sums)}, SUM(o.open_amount) AS total
+            FROM ({OPEN_INVOICES}) o
+            JOIN contacts c ON c.id = o.customer_id
+            GROUP BY o.customer_id
+            ORDER BY c.name""",
+        (as_of,),
+    ).fetchall()
+    db.close()
+
+    totals = {column: sum(row[column] for row in rows) for column, *_ in AGING_BUCKETS}
+    totals["total"] = sum(row["total"] for row in rows)
+    return render_template(
+        "sales/aging.html",
+        rows=rows,
+        buckets=AGING_BUCKETS,
+        totals=totals,
+        as_of=as_of,
+    )
+
+
+@sales_bp.route("/invoices/aging.csv")
+@login_required
+def aging_csv():
+    as_of = _aging_as_of()
+
+    db = get_db()
+    rows = db.execute(
+        f"""SELECT c.name AS customer_name, inv.invoice_number, o.invoice_date,
+                   o.due_date, o.days_past_due, o.open_amount
+            FROM ({OPEN_INVOICES}) o
+            JOIN invoices inv ON inv.id = o.id
+            JOIN contacts c ON c.id = o.customer_id
+            ORDER BY o.customer_id, o.due_date, o.id""",
+        (as_of,),
+    )
+    labels = {column: label for column, label, *_ in AGING_BUCKETS}
+
+    def generate():
+        # One open invoice per row, written a chunk at a time
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow([
+            "customer", "invoice_number", "invoice_date", "due_date",
+            "days_past_due", "bucket", "open_amount",
+        ])
+        while True:
+            chunk = rows.fetchmany(CSV_CHUNK_ROWS)
+            for row in chunk:
+                days = row["days_past_due"]
+                writer.writerow([
+                    row["customer_name"], row["invoice_number"], row["invoice_date"],
+                    row["due_date"] or "", max(days, 0),
+                    labels[_aging_bucket(days)], f"{row['open_amount']:.2f}",
+                ])
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            if not chunk:
+                break
+        db.close()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/csv",
+        headers={
+            "Content-Disposition": f'attachment; filename="ar-aging-{as_of}.csv"'
+        },
+    )
@@ -0,0 +1,297 @@
+"""Automatic ledger postings through a transactional outbox.
+
+Business transitions (invoice created, invoice paid, PO received) call
+``enqueue`` inside the same transaction as the document change, so an event
+exists exactly when the change was committed. ``drain`` turns a batch of
+pending events into balanced journal entries and posts them together:
+
+* ``invoice_created``: Dr Accounts Receivable / Cr Sales Revenue, Tax Payable
+* ``invoice_paid``:    Dr Cash / Cr Accounts Receivable
+* ``po_received``:     Dr Inventory, Tax Payable (input tax) / Cr Accounts Payable
+
+A background thread drains the outbox right after a request that enqueued
+events and every ``OUTBOX_POLL_SECONDS``, so requests only pay for one
+INSERT. ``flask accounting drain-outbox`` does the same from the command line.
+"""
+import json
+import threading
+import time
+
+from flask import g, has_request_context
+
+from erp.db import get_db
+from erp.ledger import closed_through, insert_entries, post_entries
+
+ACCOUNT_CODES = {
+    "cash": "1000",
+    "receivable": "1100",
+    "inventory": "1200",
+    "payable": "2000",
+    "tax": "2200",
+    "revenue": "4000",
+}
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_POLL_SECONDS = 5.0
+
+
+def _invoice_created(p):
+    return f"Invoice {p['reference']}", [
+        ("receivable", p["total"], 0.0),
+        ("revenue", 0.0, p["subtotal"]),
+        ("tax", 0.0, p["tax"]),
+    ]
+
+
+def _invoice_paid(p):
+    return f"Payment for invoice {p['reference']}", [
+        ("cash", p["total"], 0.0),
+        ("receivable", 0.0, p["total"]),
+    ]
+
+
+def _po_received(p):
+    return f"Goods received on {p['reference']}", [
+        ("inventory", p["subtotal"], 0.0),
+        ("tax", p["tax"], 0.0),
+        ("payable", 0.0, p["total"]),
+    ]
+
+
+EVENTS = {
+    "invoice_created": _invoice_created,
+    "invoice_paid": _invoice_paid,
+    "po_received": _po_received,
+}
+
+
+class DrainResult:
+    __slots__ = ("events", "entries", "failed", "seconds")
+
+    def __init__(self, events=0, entries=0, failed=0, seconds=0.0):
+        self.events = events
+        self.entries = entries
+        self.failed = failed
+        self.seconds = seconds
+
+
+def enqueue(db, event, document_id, entry_date, reference, subtotal, tax, total):
+    """Record a ledger event; call inside the document change's transaction."""
+    if event not in EVENTS:
+        raise ValueError(f"Unknown ledger event: {event}")
+    payload = {
+        "date": entry_date,
+        "reference": reference,
+        "subtotal": round(subtotal or 0.0, 2),
+        "tax": round(tax or 0.0, 2),
+        "total": round(total or 0.0, 2),
+    }
+    db.execute(
+        "INSERT INTO ledger_outbox (event, document_id, payload) VALUES (?, ?, ?)",
+        (event, document_id, json.dumps(payload)),
+    )
+    if has_request_context():
+        g.outbox_enqueued = True
+
+
+def enqueue_select(db, event, query, params=()):
+    """Record one ledger event per row of ``query``; returns how many.
+
+    ``query`` selects columns named ``document_id``, ``entry_date``,
+    ``reference``, ``subtotal``, ``tax`` and ``total``, so a bulk operation
+    enqueues its events with one INSERT ... SELECT instead of a call per
+    document.
+    """
+    if event not in EVENTS:
+        raise ValueError(f"Unknown ledger event: {event}")
+    count = db.execute(
+        f"""INSERT INTO ledger_outbox (event, document_id, payload)
+            SELECT ?, q.document_id,
+                   json_object('date', q.entry_date, 'reference', q.reference,
+                               'subtotal', round(COALESCE(q.subtotal, 0), 2),
+                               'tax', round(COALESCE(q.tax, 0), 2),
+                               'total', round(COALESCE(q.total, 0), 2))
+            FROM ({query}) AS q""",
+        (event, *params),
+    ).rowcount
+    if count and has_request_context():
+        g.outbox_enqueued = True
+    return count
+
+
+def _build_entry(row, accounts, closed):
+    """Return ``(entry_date, reference, description, lines)``; raises ValueError."""
+    payload = json.loads(row["payload"])
+    if closed and payload["date"] <= closed:
+        raise ValueError(f"the books are closed through {closed}")
+    description, lines = EVENTS[row["event"]](payload)
+    resolved = []
+    for key, debit, credit in lines:
+        if not debit and not credit:
+            continue
+        account_id = accounts.get(ACCOUNT_CODES[key])
+        if account_id is None:
+            raise ValueError(f"no active account {ACCOUNT_CODES[key]} ({key})")
+        resolved.append((account_id, debit, credit))
+    return payload["date"], payload["reference"], description, resolved
+
+
+def drain(db, batch_size=DEFAULT_BATCH_SIZE):
+    """Turn up to ``batch_size`` pending events into posted journal entries.
+
+    Runs in its own ``BEGIN IMMEDIATE`` transaction, so concurrent drains
+    never pick up the same event; with nothing pending it returns without
+    taking the write lock. Events that cannot be booked (e.g. a
+    missing account) or whose entry post_entries() refuses get ``error`` set,
+    keep no draft entry and are skipped until retried.
+    """
+    started = time.perf_counter()
+    if db.in_transaction:
+        db.commit()
+    # Idle polls only probe the partial index instead of taking the write lock
+    if not db.execute(
+        "SELECT 1 FROM ledger_outbox WHERE processed_at IS NULL AND error IS NULL LIMIT 1"
+    ).fetchone():
+        return DrainResult(seconds=time.perf_counter() - started)
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        rows = db.execute(
+            """SELECT id, event, payload FROM ledger_outbox
+               WHERE processed_at IS NULL AND error IS NULL
+               ORDER BY id LIMIT ?""",
+            (batch_size,),
+        ).fetchall()
+        codes = list(ACCOUNT_CODES.values())
+        accounts = dict(db.execute(
+            f"SELECT code, id FROM accounts WHERE active = 1 "
+            f"AND code IN ({', '.join('?' * len(codes))})",
+            codes,
+        ).fetchall())
+        closed = closed_through(db)
+
+        booked = []  # (event id, entry or None when all amounts are zero)
+        failed = []
+        for row in rows:
+            try:
+                entry = _build_entry(row, accounts, closed)
+            except (KeyError, ValueError) as e:
+                failed.append((str(e), row["id"]))
+                continue
+            booked.append((row["id"], entry if entry[3] else None))
+
+        entries = [entry for _, entry in booked if entry]
+        processed = []
+        unposted = {}
+        if entries:
+            next_id, last_id = insert_entries(db, entries)
+            post_entries(db, ["je.id BETWEEN ? AND ?"], [next_id, last_id])
+            # post_entries() skips unbalanced entries and closed periods; an
+            # event only counts as processed once its entry is posted
+            unposted = dict(db.execute(
+                "SELECT id, entry_date FROM journal_entries "
+                "WHERE id BETWEEN ? AND ? AND posted = 0",
+                (next_id, last_id),
+            ).fetchall())
+            if unposted:
+                ids = list(unposted)
+                marks = ", ".join("?" * len(ids))
+                db.execute(f"DELETE FROM journal_lines WHERE entry_id IN ({marks})", ids)
+                db.execute(f"DELETE FROM journal_entries WHERE id IN ({marks})", ids)
+        for event_id, entry in booked:
+            if not entry:
+                processed.append((None, event_id))
+                continue
+            if next_id in unposted:
+                if closed and unposted[next_id] <= closed:
+                    failed.append((f"the books are closed through {closed}", event_id))
+                else:
+                    failed.append(("the entry could not be posted (debits and "
+                                   "credits differ)", event_id))
+            else:
+                processed.append((next_id, event_id))
+            next_id += 1
+
+        db.executemany(
+            "UPDATE ledger_outbox SET processed_at = CURRENT_TIMESTAMP, entry_id = ? "
+            "WHERE id = ?",
+            processed,
+        )
+        db.executemany("UPDATE ledger_outbox SET error = ? WHERE id = ?", failed)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return DrainResult(
+        len(rows), len(entries) - len(unposted), len(failed), time.perf_counter() - started
+    )
+
+
+def drain_all(db, batch_size=DEFAULT_BATCH_SIZE):
+    """Drain until no pending events are left; returns the summed DrainResult."""
+    total = DrainResult()
+    while True:
+        result = drain(db, batch_size)
+        total.events += result.events
+        total.entries += result.entries
+        total.failed += result.failed
+        total.seconds += result.seconds
+        if result.events < batch_size:
+            return total
+
+
+def retry_failed(db):
+    """Clear the error of failed events so the next drain picks them up again."""
+    count = db.execute(
+        "UPDATE ledger_outbox SET error = NULL "
+        "WHERE processed_at IS NULL AND error IS NOT NULL"
+    ).rowcount
+    db.commit()
+    return count
+
+
+class OutboxWorker:
+    """Background thread that drains the outbox for one app.
+
+    The thread starts on the first ``wake()``, i.e. the first request that
+    enqueued an event, so CLI commands and idle workers never spawn it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def wake(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="ledger-outbox", daemon=True
+                )
+                self._thread.start()
+        self._event.set()
+
+    def _run(self):
+        interval = self.app.config["OUTBOX_POLL_SECONDS"]
+        batch_size = self.app.config["OUTBOX_BATCH_SIZE"]
+        while True:
+            self._event.wait(interval)
+            self._event.clear()
+            try:
+                with self.app.app_context():
+                    drain_all(get_db(), batch_size)
+            except Exception:
+                self.app.logger.exception("Draining the ledger outbox failed")
+
+
+def init_app(app):
+    app.config.setdefault("OUTBOX_WORKER", True)
+    app.config.setdefault("OUTBOX_POLL_SECONDS", DEFAULT_POLL_SECONDS)
+    app.config.setdefault("OUTBOX_BATCH_SIZE", DEFAULT_BATCH_SIZE)
+    worker = OutboxWorker(app)
+    app.extensions["erp_outbox"] = worker
+
+    @app.teardown_request
+    def wake_outbox_worker(exc=None):
+        if g.pop("outbox_enqueued", False) and exc is None and app.config["OUTBOX_WORKER"]:
+            worker.wake()
@@ -0,0 +1,96 @@
+"""Overdue invoices: due dates from payment terms and the status sweep.
+
+``sweep`` moves every ``sent`` invoice whose ``due_date`` has passed to
+``overdue`` with a single UPDATE on the partial index
+``idx_invoices_sent_due`` and records the run in ``job_runs``. It runs from
+cron via ``flask --app app sales sweep-overdue`` or from the in-process
+OverdueSweeper, which sweeps once when the first request arrives and then
+every ``OVERDUE_SWEEP_SECONDS``. Sweeps are idempotent, so several worker
+processes sweeping at once is harmless.
+"""
+import threading
+import time
+from datetime import date, timedelta
+
+from erp.db import get_db
+
+DEFAULT_PAYMENT_TERMS_DAYS = 30
+DEFAULT_SWEEP_SECONDS = 3600.0
+JOB = "overdue_sweep"
+
+
+def due_date(db, customer_id, invoice_date, default_days=DEFAULT_PAYMENT_TERMS_DAYS):
+    """ISO due date from the customer's payment terms, else ``default_days``."""
+    row = db.execute(
+        "SELECT payment_terms_days FROM contacts WHERE id = ?", (customer_id,)
+    ).fetchone()
+    days = row[0] if row and row[0] is not None else default_days
+    return (date.fromisoformat(invoice_date) + timedelta(days=days)).isoformat()
+
+
+def sweep(db, today=None):
+    """Mark sent invoices due before ``today`` overdue; returns how many moved."""
+    started = time.perf_counter()
+    today = (today or date.today()).isoformat()
+    if db.in_transaction:
+        db.commit()
+    try:
+        moved = db.execute(
+            """UPDATE invoices INDEXED BY idx_invoices_sent_due SET status = 'overdue'
+               WHERE status = 'sent' AND due_date < ?""",
+            (today,),
+        ).rowcount
+        db.execute(
+            "INSERT INTO job_runs (job, rows, seconds) VALUES (?, ?, ?)",
+            (JOB, moved, time.perf_counter() - started),
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return moved
+
+
+class OverdueSweeper:
+    """Background thread that sweeps overdue invoices for one app.
+
+    Started by the first request, so CLI commands never spawn it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="overdue-sweeper", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        interval = self.app.config["OVERDUE_SWEEP_SECONDS"]
+        while True:
+            try:
+                with self.app.app_context():
+                    moved = sweep(get_db())
+                if moved:
+                    self.app.logger.info("Marked %d invoices overdue", moved)
+            except Exception:
+                self.app.logger.exception("Sweeping overdue invoices failed")
+            time.sleep(interval)
+
+
+def init_app(app):
+    app.config.setdefault("DEFAULT_PAYMENT_TERMS_DAYS", DEFAULT_PAYMENT_TERMS_DAYS)
+    app.config.setdefault("OVERDUE_SWEEPER", True)
+    app.config.setdefault("OVERDUE_SWEEP_SECONDS", DEFAULT_SWEEP_SECONDS)
+    sweeper = OverdueSweeper(app)
+    app.extensions["erp_overdue_sweeper"] = sweeper
+
+    @app.before_request
+    def start_overdue_sweeper():
+        if sweeper._thread is None and app.config["OVERDUE_SWEEPER"]:
+            sweeper.start()
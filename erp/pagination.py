@@ -0,0 +1,69 @@
+"""Keyset (cursor) pagination for list views.
+
+Pages are selected with a row-value comparison on the sort key, e.g.
+``(created_at, id) < (?, ?)``, so the cost of a page does not depend on how
+deep into the list it is and rows inserted meanwhile never shift a page.
+"""
+import base64
+import binascii
+import json
+
+PAGE_SIZE = 50
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """Return the list of key values in ``token``, or None if it is missing or invalid."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        return None
+    if not isinstance(values, list):
+        return None
+    # Only scalars can be bound as parameters; bool is not a sort key value
+    if not all(v is None or type(v) in (str, int, float) for v in values):
+        return None
+    return values
+
+
+def paginate(db, select, conditions, params, order, cursor=None,
+             page_size=PAGE_SIZE, descending=True):
+    """Run ``select`` for one page and return ``(rows, next_cursor)``.
+
+    ``order`` is a list of ``(sql_expression, row_key)`` pairs forming a
+    unique sort key (end it with the primary key). ``next_cursor`` is None
+    on the last page.
+    """
+    conditions = list(conditions)
+    params = list(params)
+    exprs = [expr for expr, _ in order]
+
+    values = decode_cursor(cursor)
+    if values is not None and len(values) == len(order):
+        op = "<" if descending else ">"
+        conditions.append(
+            f"({', '.join(exprs)}) {op} ({', '.join('?' * len(exprs))})"
+        )
+        params.extend(values)
+
+    sql = select
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    direction = " DESC" if descending else ""
+    sql += " ORDER BY " + ", ".join(expr + direction for expr in exprs)
+    sql += " LIMIT ?"
+    params.append(page_size + 1)
+
+    rows = db.execute(sql, params).fetchall()
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1][key] for _, key in order)
+    return rows, next_cursor
@@ -0,0 +1,493 @@
+"""Customer payments from bank statements and their allocation to invoices.
+
+import_payments() books every incoming payment of a statement (CSV, or an
+ISO 20022 camt.053/camt.054 XML file) in one ``BEGIN IMMEDIATE``
+transaction. Under that lock the open invoices and customers are loaded
+once into in-memory hash indexes (by invoice number, customer, open amount
+and normalized customer name), and each payment is matched against them:
+
+1. invoice numbers found in the payment reference;
+2. else the customer, from a ``customer_id`` column or the payer's name:
+   an open invoice of exactly the paid amount, else all of the customer's
+   open invoices;
+3. else the only open invoice of exactly the paid amount, if there is one.
+
+The amount is allocated to the matched invoices oldest due date first, so
+a short payment leaves the newest invoice partly paid and an overpayment
+stays on the payment as unallocated. Payments, allocations, invoice
+amounts and statuses and the ``invoice_paid`` ledger events are written
+``batch_size`` payments at a time with one statement per table. Bank
+transaction ids are unique, so importing a statement twice books nothing
+twice.
+"""
+import csv
+import itertools
+import json
+import math
+import re
+import time
+import xml.etree.ElementTree as ET
+from datetime import date
+
+from erp import outbox
+from erp.journal_import import Rejection
+from erp.ledger import closed_through
+
+FORMATS = ("csv", "camt")
+CSV_FIELDS = ("date", "amount")
+OPEN_STATUSES = ("draft", "sent", "overdue")
+DEFAULT_BATCH_SIZE = 500
+TOLERANCE = 0.005
+
+_TOKEN = re.compile(r"[A-Za-z0-9]+(?:-[A-Za-z0-9]+)*")
+_NAME_NOISE = re.compile(r"[^0-9a-z]+")
+
+
+class StatementLine:
+    __slots__ = ("line", "payment_date", "amount", "reference", "counterparty",
+                 "transaction_id", "customer_id")
+
+    def __init__(self, line, payment_date, amount, reference="", counterparty="",
+                 transaction_id=None, customer_id=None):
+        self.line = line
+        self.payment_date = payment_date
+        self.amount = amount
+        self.reference = reference
+        self.counterparty = counterparty
+        self.transaction_id = transaction_id
+        self.customer_id = customer_id
+
+
+class ImportReport:
+    """Outcome of import_payments()."""
+
+    def __init__(self):
+        self.payments = 0
+        self.matched = 0
+        self.partial = 0
+        self.unmatched = 0
+        self.outgoing = 0
+        self.duplicates = 0
+        self.allocations = 0
+        self.invoices_paid = 0
+        self.amount = 0.0
+        self.allocated = 0.0
+        self.rejected = []
+        self.seconds = 0.0
+
+    @property
+    def payments_per_second(self):
+        return self.payments / self.seconds if self.seconds else 0.0
+
+
+def format_for(filename):
+    """Guess the statement format from a file name; None if unknown."""
+    name = (filename or "").lower()
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith(".xml"):
+        return "camt"
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Reading statements
+# ---------------------------------------------------------------------------
+
+def _local(tag):
+    return tag.rpartition("}")[2]
+
+
+def _child(elem, *path):
+    """First descendant along ``path`` of local tag names, ignoring namespaces."""
+    for name in path:
+        if elem is None:
+            return None
+        elem = next((c for c in elem if _local(c.tag) == name), None)
+    return elem
+
+
+def _text(elem, *path):
+    found = _child(elem, *path)
+    return (found.text or "").strip() if found is not None else ""
+
+
+def _camt_entry(entry):
+    """Row dict of one camt ``Ntry``; None for debits (outgoing payments)."""
+    amount = _text(entry, "Amt")
+    if _text(entry, "CdtDbtInd") == "DBIT":
+        return None
+    booked = _text(entry, "BookgDt", "Dt") or _text(entry, "BookgDt", "DtTm")[:10] \
+        or _text(entry, "ValDt", "Dt")
+    references = []
+    counterparty = ""
+    details = _child(entry, "NtryDtls")
+    for tx in (details if details is not None else ()):
+        if _local(tx.tag) != "TxDtls":
+            continue
+        remittance = _child(tx, "RmtInf")
+        for item in (remittance if remittance is not None else ()):
+            if _local(item.tag) == "Ustrd" and item.text:
+                references.append(item.text.strip())
+            elif _local(item.tag) == "Strd":
+                ref = _text(item, "CdtrRefInf", "Ref")
+                if ref:
+                    references.append(ref)
+        counterparty = counterparty or _text(tx, "RltdPties", "Dbtr", "Nm") \
+            or _text(tx, "RltdPties", "Dbtr", "Pty", "Nm")
+    return {
+        "date": booked,
+        "amount": amount,
+        "reference": " ".join(references) or _text(entry, "AddtlNtryInf"),
+        "counterparty": counterparty,
+        "transaction_id": _text(entry, "AcctSvcrRef") or _text(entry, "NtryRef"),
+    }
+
+
+def read_statement(stream, fmt):
+    """Yield ``(line_number, row_dict)`` from a statement file.
+
+    CSV needs the columns ``date`` and ``amount`` and may have
+    ``reference``, ``counterparty``, ``transaction_id`` and ``customer_id``;
+    negative amounts are outgoing payments. For camt the line number is the
+    entry's position in the statement and debit entries yield None. Raises
+    ValueError for an unknown format, a CSV header without CSV_FIELDS or
+    XML that does not parse.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        missing = [f for f in CSV_FIELDS if f not in (reader.fieldnames or ())]
+        if missing:
+            raise ValueError(f"CSV header is missing: {', '.join(missing)}")
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == "camt":
+        number = 0
+        try:
+            for _, elem in ET.iterparse(stream):
+                if _local(elem.tag) == "Ntry":
+                    number += 1
+                    yield number, _camt_entry(elem)
+                    elem.clear()
+        except ET.ParseError as e:
+            raise ValueError(f"Invalid XML: {e}") from None
+    else:
+        raise ValueError(f"Unknown statement format: {fmt}")
+
+
+def _statement_line(number, row):
+    """StatementLine for an incoming payment, None for an outgoing one.
+
+    Raises ValueError.
+    """
+    try:
+        amount = round(float(str(row.get("amount") or "").strip()), 2)
+    except ValueError:
+        raise ValueError(f"invalid amount {row.get('amount')!r}") from None
+    if not math.isfinite(amount):
+        raise ValueError(f"invalid amount {row.get('amount')!r}")
+    if amount <= 0:
+        return None
+    payment_date = str(row.get("date") or "").strip()
+    try:
+        date.fromisoformat(payment_date)
+    except ValueError:
+        raise ValueError(f"invalid date {payment_date!r}") from None
+    customer_id = str(row.get("customer_id") or "").strip()
+    if customer_id and not customer_id.isdigit():
+        raise ValueError(f"invalid customer_id {customer_id!r}")
+    return StatementLine(
+        number, payment_date, amount,
+        str(row.get("reference") or "").strip(),
+        str(row.get("counterparty") or "").strip(),
+        str(row.get("transaction_id") or "").strip() or None,
+        int(customer_id) if customer_id else None,
+    )
+
+
+# ---------------------------------------------------------------------------
+# Matching
+# ---------------------------------------------------------------------------
+
+def _cents(amount):
+    return round(amount * 100)
+
+
+def _name_key(name):
+    return _NAME_NOISE.sub(" ", (name or "").casefold()).strip()
+
+
+class OpenInvoice:
+    __slots__ = ("id", "number", "customer_id", "open", "paid")
+
+    def __init__(self, id, number, customer_id, open_amount):
+        self.id = id
+        self.number = number
+        self.customer_id = customer_id
+        self.open = open_amount
+        self.paid = 0.0
+
+
+class Matcher:
+    """Hash indexes over the open invoices and customers, built once.
+
+    Lists keep invoices oldest due date first. Paid-off invoices stay in
+    them and are skipped on lookup; a per-customer cursor skips the paid-off
+    head of each customer's list, so allocating oldest first does not rescan
+    the invoices it has already paid.
+    """
+
+    def __init__(self, db):
+        self.by_number = {}
+        self.by_customer = {}
+        self.by_customer_amount = {}
+        self.by_amount = {}
+        self._head = {}
+        for row in db.execute(
+            f"""SELECT id, invoice_number, customer_id, total - amount_paid
+                FROM invoices
+                WHERE status IN ({', '.join('?' * len(OPEN_STATUSES))})
+                  AND total - amount_paid > ?
+                ORDER BY COALESCE(due_date, invoice_date), invoice_date, id""",
+            (*OPEN_STATUSES, TOLERANCE),
+        ):
+            inv = OpenInvoice(*row)
+            cents = _cents(inv.open)
+            self.by_number[inv.number.upper()] = inv
+            self.by_customer.setdefault(inv.customer_id, []).append(inv)
+            self.by_customer_amount.setdefault((inv.customer_id, cents), []).append(inv)
+            self.by_amount.setdefault(cents, []).append(inv)
+
+        self.customers = set()
+        self.by_name = {}
+        for customer_id, name in db.execute(
+            "SELECT id, name FROM contacts WHERE contact_type IN ('customer', 'both')"
+        ):
+            self.customers.add(customer_id)
+            key = _name_key(name)
+            # Two customers with the same name match neither
+            self.by_name[key] = None if key in self.by_name else customer_id
+
+    def _oldest(self, customer_id):
+        """Yield the customer's open invoices, oldest due date first."""
+        invoices = self.by_customer.get(customer_id, ())
+        i = self._head.get(customer_id, 0)
+        while i < len(invoices) and invoices[i].open <= TOLERANCE:
+            i += 1
+        self._head[customer_id] = i
+        for inv in invoices[i:]:
+            if inv.open > TOLERANCE:
+                yield inv
+
+    @staticmethod
+    def _same_amount(invoices, amount, limit):
+        """Up to ``limit`` invoices whose open amount is still ``amount``."""
+        cents = _cents(amount)
+        found = []
+        for inv in invoices:
+            if _cents(inv.open) == cents:
+                found.append(inv)
+                if len(found) == limit:
+                    break
+        return found
+
+    def match(self, line):
+        """Return ``(customer_id, iterable of invoices to allocate to, in order)``."""
+        first = []
+        for token in _TOKEN.findall(line.reference.upper()):
+            inv = self.by_number.get(token)
+            if inv is not None and inv.open > TOLERANCE and inv not in first:
+                first.append(inv)
+
+        customer_id = line.customer_id if line.customer_id in self.customers else None
+        if customer_id is None and first:
+            customer_id = first[0].customer_id
+        if customer_id is None:
+            customer_id = self.by_name.get(_name_key(line.counterparty))
+
+        if customer_id is None:
+            candidates = self._same_amount(
+                self.by_amount.get(_cents(line.amount), ()), line.amount, 2
+            )
+            if len(candidates) != 1:
+                return None, ()
+            return candidates[0].customer_id, candidates
+
+        if first:
+            first = [inv for inv in first if inv.customer_id == customer_id]
+        else:
+            first = self._same_amount(
+                self.by_customer_amount.get((customer_id, _cents(line.amount)), ()),
+                line.amount, 1,
+            )
+        rest = (inv for inv in self._oldest(customer_id) if inv not in first)
+        return customer_id, itertools.chain(first, rest)
+
+    def allocate(self, line):
+        """Match ``line`` and allocate its amount oldest first.
+
+        Returns ``(customer_id, [(invoice, amount)])``.
+        """
+        customer_id, invoices = self.match(line)
+        remaining = line.amount
+        allocations = []
+        for inv in invoices:
+            if remaining <= TOLERANCE:
+                break
+            amount = round(min(remaining, inv.open), 2)
+            inv.open = round(inv.open - amount, 2)
+            inv.paid = round(inv.paid + amount, 2)
+            remaining = round(remaining - amount, 2)
+            allocations.append((inv, amount))
+        return customer_id, allocations
+
+
+# ---------------------------------------------------------------------------
+# Import
+# ---------------------------------------------------------------------------
+
+def _next_payment_id(db):
+    # Honour AUTOINCREMENT's high-water mark so ids are never reused
+    return db.execute(
+        """SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'payments'), 0),
+                      COALESCE((SELECT MAX(id) FROM payments), 0)) + 1"""
+    ).fetchone()[0]
+
+
+def _write_batch(db, matcher, batch, report):
+    first_id = _next_payment_id(db)
+    payments = []
+    allocations = []
+    invoices = {}
+    for payment_id, line in enumerate(batch, first_id):
+        customer_id, allocated = matcher.allocate(line)
+        total = round(sum(amount for _, amount in allocated), 2)
+        if not allocated:
+            status = "unmatched"
+            report.unmatched += 1
+        elif line.amount - total > TOLERANCE:
+            status = "partial"
+            report.partial += 1
+        else:
+            status = "matched"
+            report.matched += 1
+        payments.append((
+            payment_id, line.payment_date, line.amount, total, customer_id,
+            line.reference, line.counterparty, line.transaction_id, status,
+        ))
+        for inv, amount in allocated:
+            allocations.append((payment_id, inv.id, amount))
+            invoices[inv.id] = inv
+        report.amount += line.amount
+        report.allocated += total
+
+    db.executemany(
+        """INSERT INTO payments
+           (id, payment_date, amount, allocated, customer_id, reference,
+            counterparty, transaction_id, status)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        payments,
+    )
+    db.executemany(
+        "INSERT INTO payment_allocations (payment_id, invoice_id, amount) VALUES (?, ?, ?)",
+        allocations,
+    )
+    # One row per invoice touched by the batch, with what the batch paid on it
+    db.executemany(
+        """UPDATE invoices
+           SET amount_paid = round(amount_paid + ?, 2),
+               status = CASE WHEN total - amount_paid - ? <= ? THEN 'paid' ELSE status END
+           WHERE id = ?""",
+        [(inv.paid, inv.paid, TOLERANCE, inv.id) for inv in invoices.values()],
+    )
+    report.invoices_paid += sum(1 for inv in invoices.values() if inv.open <= TOLERANCE)
+    for inv in invoices.values():
+        inv.paid = 0.0
+    outbox.enqueue_select(
+        db, "invoice_paid",
+        """SELECT pa.invoice_id AS document_id, p.payment_date AS entry_date,
+                  inv.invoice_number AS reference, pa.amount AS subtotal,
+                  0 AS tax, pa.amount AS total
+           FROM payment_allocations pa
+           JOIN payments p ON p.id = pa.payment_id
+           JOIN invoices inv ON inv.id = pa.invoice_id
+           WHERE pa.payment_id BETWEEN ? AND ?
+           ORDER BY pa.id""",
+        (first_id, first_id + len(batch) - 1),
+    )
+    report.payments += len(batch)
+    report.allocations += len(allocations)
+
+
+def _existing_transactions(db, lines):
+    ids = [line.transaction_id for line in lines if line.transaction_id]
+    if not ids:
+        return set()
+    return {
+        row[0] for row in db.execute(
+            "SELECT transaction_id FROM payments "
+            "WHERE transaction_id IN (SELECT value FROM json_each(?))",
+            (json.dumps(ids),),
+        )
+    }
+
+
+def import_payments(db, rows, batch_size=DEFAULT_BATCH_SIZE):
+    """Import the ``(line_number, row)`` pairs from read_statement().
+
+    The statement is read and validated before the write lock is taken;
+    matching and booking then run in one transaction, so the invoice
+    indexes stay valid for the whole statement and a failed import books
+    nothing. Invalid rows, payments dated in a closed period and payments
+    already imported are reported and skipped. Returns an ImportReport.
+    """
+    started = time.perf_counter()
+    report = ImportReport()
+    lines = []
+    for number, row in rows:
+        if row is None:
+            report.outgoing += 1
+            continue
+        try:
+            line = _statement_line(number, row)
+        except ValueError as e:
+            report.rejected.append(Rejection(number, str(row.get("reference") or ""), str(e)))
+            continue
+        if line is None:
+            report.outgoing += 1
+        else:
+            lines.append(line)
+
+    if db.in_transaction:
+        db.commit()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        closed = closed_through(db)
+        if closed:
+            for line in lines:
+                if line.payment_date <= closed:
+                    report.rejected.append(Rejection(
+                        line.line, line.reference, f"the books are closed through {closed}"
+                    ))
+            report.rejected.sort(key=lambda r: r.line)
+            lines = [line for line in lines if line.payment_date > closed]
+
+        seen = _existing_transactions(db, lines)
+        fresh = []
+        for line in lines:
+            if line.transaction_id is not None:
+                if line.transaction_id in seen:
+                    report.duplicates += 1
+                    continue
+                seen.add(line.transaction_id)
+            fresh.append(line)
+
+        matcher = Matcher(db)
+        for start in range(0, len(fresh), batch_size):
+            _write_batch(db, matcher, fresh[start:start + batch_size], report)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    report.seconds = time.perf_counter() - started
+    return report
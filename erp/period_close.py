@@ -0,0 +1,247 @@
+"""Fiscal period close.
+
+close_period() closes every month up to and including ``period`` in one
+transaction:
+
+1. a closing entry moves the balances of revenue and expense accounts into
+   Retained Earnings (3100). It is bookkeeping, not activity, so its lines
+   are taken back out of period_balances;
+2. journal entries and lines dated in the period, and the outbox events that
+   produced them, move to the archive database (erp.db.archive_path);
+3. a balances-brought-forward entry dated the period's last day carries each
+   account's closing balance, so running balances and the account ledger in
+   the hot database still start from the right figure.
+
+period_balances rows of closed months stay in the hot database, so reports
+over whole closed months never open the archive. Afterwards no entry dated
+on or before the period's end can be created or posted.
+"""
+import calendar
+import time
+from datetime import date, timedelta
+
+from erp.db import attach_archive
+from erp.ledger import closed_through, insert_entries, post_entries
+
+RETAINED_EARNINGS = "3100"
+
+ENTRY_COLUMNS = (
+    "id, entry_date, reference, description, posted, created_at, total_debit, total_credit"
+)
+LINE_COLUMNS = (
+    "id, entry_id, account_id, debit, credit, description, entry_date, running_balance"
+)
+OUTBOX_COLUMNS = "id, event, document_id, payload, created_at, processed_at, entry_id, error"
+
+
+class CloseResult:
+    __slots__ = ("period", "end_date", "net_income", "entries", "lines", "seconds")
+
+    def __init__(self, period, end_date, net_income=0.0, entries=0, lines=0, seconds=0.0):
+        self.period = period
+        self.end_date = end_date
+        self.net_income = net_income
+        self.entries = entries
+        self.lines = lines
+        self.seconds = seconds
+
+
+def period_end(period):
+    """Last day of a ``YYYY-MM`` period; raises ValueError."""
+    try:
+        start = date.fromisoformat(f"{period}-01")
+    except (TypeError, ValueError):
+        raise ValueError(f"Period must be YYYY-MM, not {period!r}") from None
+    return start.replace(day=calendar.monthrange(start.year, start.month)[1])
+
+
+def _balances(db, end):
+    """``[(account_id, account_type, balance)]`` of every account at ``end``."""
+    return db.execute(
+        """SELECT a.id, a.account_type,
+                  COALESCE((SELECT jl.running_balance FROM main.journal_lines jl
+                            WHERE jl.account_id = a.id AND jl.entry_date <= ?
+                            ORDER BY jl.entry_date DESC, jl.id DESC
+                            LIMIT 1), 0)
+           FROM main.accounts a ORDER BY a.id""",
+        (end,),
+    ).fetchall()
+
+
+def _line(account_type, balance):
+    """Line that carries ``balance`` in the account's normal direction."""
+    balance = round(balance, 2)
+    if account_type in ("asset", "expense"):
+        return (balance, 0.0) if balance > 0 else (0.0, -balance)
+    return (0.0, balance) if balance > 0 else (-balance, 0.0)
+
+
+def _check(db, end, retained_earnings):
+    last = closed_through(db)
+    if last and end <= last:
+        raise ValueError(f"The books are already closed through {last}.")
+    if retained_earnings is None:
+        raise ValueError(f"Account {RETAINED_EARNINGS} (Retained Earnings) does not exist.")
+    drafts = db.execute(
+        "SELECT COUNT(*) FROM main.journal_entries WHERE posted = 0 AND entry_date <= ?",
+        (end,),
+    ).fetchone()[0]
+    if drafts:
+        raise ValueError(
+            f"{drafts} unposted journal entries are dated on or before {end}; "
+            "post them first."
+        )
+    pending = db.execute(
+        """SELECT COUNT(*) FROM main.ledger_outbox
+           WHERE processed_at IS NULL AND json_extract(payload, '$.date') <= ?""",
+        (end,),
+    ).fetchone()[0]
+    if pending:
+        raise ValueError(
+            f"{pending} ledger outbox events for the period are not booked yet; "
+            "run `flask accounting drain-outbox` first."
+        )
+
+
+def _close_entry(db, period, end, balances, retained_earnings):
+    """Insert and post the closing entry; returns ``(entry_id, net_income)``."""
+    lines = []
+    net_income = 0.0
+    for account_id, account_type, balance in balances:
+        if account_type not in ("revenue", "expense") or round(balance, 2) == 0:
+            continue
+        # Reverse the balance to bring the account to zero
+        debit, credit = _line(account_type, balance)
+        lines.append((account_id, credit, debit))
+        net_income += balance if account_type == "revenue" else -balance
+    net_income = round(net_income, 2)
+    if not lines:
+        return None, 0.0
+    if net_income:
+        lines.append((retained_earnings, *_line("equity", net_income)))
+
+    entry_id, _ = insert_entries(db, [(
+        end, f"CLOSE-{period}", f"Close {period} to Retained Earnings", lines,
+    )])
+    post_entries(db, ["je.id = ?"], [entry_id])
+    db.execute(
+        """UPDATE period_balances AS pb SET debit = pb.debit - l.debit,
+                                            credit = pb.credit - l.credit
+           FROM (SELECT account_id, SUM(debit) AS debit, SUM(credit) AS credit
+                 FROM main.journal_lines WHERE entry_id = ?
+                 GROUP BY account_id) AS l
+           WHERE pb.account_id = l.account_id AND pb.period = ?""",
+        (entry_id, end[:7]),
+    )
+    return entry_id, net_income
+
+
+def _archive(db, end):
+    """Move entries dated up to ``end`` to the archive; returns (entries, lines)."""
+    archived = "SELECT id FROM main.journal_entries WHERE entry_date <= ?"
+    db.execute(
+        f"""INSERT OR REPLACE INTO archive.journal_entries ({ENTRY_COLUMNS})
+            SELECT {ENTRY_COLUMNS} FROM main.journal_entries WHERE entry_date <= ?""",
+        (end,),
+    )
+    db.execute(
+        f"""INSERT OR REPLACE INTO archive.journal_lines ({LINE_COLUMNS})
+            SELECT {LINE_COLUMNS} FROM main.journal_lines
+            WHERE entry_id IN ({archived})""",
+        (end,),
+    )
+    db.execute(
+        f"""INSERT OR REPLACE INTO archive.ledger_outbox ({OUTBOX_COLUMNS})
+            SELECT {OUTBOX_COLUMNS} FROM main.ledger_outbox
+            WHERE entry_id IN ({archived})""",
+        (end,),
+    )
+    db.execute(f"DELETE FROM main.ledger_outbox WHERE entry_id IN ({archived})", (end,))
+    lines = db.execute(
+        f"DELETE FROM main.journal_lines WHERE entry_id IN ({archived})", (end,)
+    ).rowcount
+    entries = db.execute(
+        "DELETE FROM main.journal_entries WHERE entry_date <= ?", (end,)
+    ).rowcount
+    return entries, lines
+
+
+def _bring_forward(db, period, end, balances):
+    """Insert the posted brought-forward entry; returns its id or None."""
+    lines = []
+    carried = {}
+    for account_id, account_type, balance in balances:
+        if round(balance, 2) == 0:
+            continue
+        lines.append((account_id, *_line(account_type, balance)))
+        carried[account_id] = round(balance, 2)
+    if not lines:
+        return None
+    debits = round(sum(line[1] for line in lines), 2)
+    credits = round(sum(line[2] for line in lines), 2)
+    if debits != credits:
+        raise ValueError(
+            f"Balances at {end} do not balance (debits {debits:.2f}, credits "
+            f"{credits:.2f}); run `flask accounting verify-ledger` first."
+        )
+
+    entry_id, _ = insert_entries(db, [(
+        end, f"BF-{period}", f"Balances brought forward at {end}", lines,
+    )])
+    db.execute("UPDATE main.journal_entries SET posted = 1 WHERE id = ?", (entry_id,))
+    # Only line of each account on or before the close, so the running
+    # balance is the balance itself; balances and period_balances are unchanged
+    db.executemany(
+        "UPDATE main.journal_lines SET entry_date = ?, running_balance = ? "
+        "WHERE entry_id = ? AND account_id = ?",
+        [(end, balance, entry_id, account_id) for account_id, balance in carried.items()],
+    )
+    return entry_id
+
+
+def close_period(db, period, today=None):
+    """Close the books through the ``YYYY-MM`` period; returns a CloseResult.
+
+    Raises ValueError if the period has not ended yet, is already closed,
+    or still has drafts or unbooked outbox events.
+    """
+    started = time.perf_counter()
+    end = period_end(period)
+    if end >= (today or date.today()):
+        raise ValueError(f"Period {period} has not ended yet.")
+    end = end.isoformat()
+
+    if db.in_transaction:
+        db.commit()
+    with attach_archive(db):
+        # Locks the main and the archive database
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                "SELECT id FROM main.accounts WHERE code = ?", (RETAINED_EARNINGS,)
+            ).fetchone()
+            retained_earnings = row[0] if row else None
+            _check(db, end, retained_earnings)
+            last = closed_through(db)
+            start = (date.fromisoformat(last) + timedelta(days=1)).isoformat() if last else None
+
+            closing_id, net_income = _close_entry(
+                db, period, end, _balances(db, end), retained_earnings
+            )
+            balances = _balances(db, end)
+            entries, lines = _archive(db, end)
+            opening_id = _bring_forward(db, period, end, balances)
+
+            db.execute(
+                """INSERT INTO main.fiscal_periods
+                   (period, start_date, end_date, net_income, closing_entry_id,
+                    opening_entry_id, entries_archived, lines_archived)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                (period, start, end, net_income, closing_id, opening_id, entries, lines),
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+    return CloseResult(period, end, net_income, entries, lines,
+                       time.perf_counter() - started)
@@ -0,0 +1,116 @@
+"""Gap-tolerant, concurrency-safe document numbers (SO-0001, INV-2026-000001, ...).
+
+Counters live in the ``sequences`` table, keyed by the rendered number stem
+(``"SO-"``, ``"SO-2026-"``), and are bumped under ``BEGIN IMMEDIATE`` so two
+writers can never hand out the same value. A worker can reserve a block of
+values at once (``SEQUENCE_BLOCK_SIZE``) and serve numbers from memory until
+the block runs out; unused values of a block are lost when the process
+exits, so numbers may have gaps but never repeat.
+"""
+import sqlite3
+import threading
+from datetime import date
+
+from flask import current_app, has_app_context
+
+DEFAULT_FORMAT = "{prefix}-{seq:04d}"
+
+
+def allocate(conn, name, count=1, start=None):
+    """Reserve ``count`` consecutive values of sequence ``name``.
+
+    Returns the first reserved value. ``start`` is called to compute the
+    initial value the first time ``name`` is used. Outside a transaction the
+    reservation commits on its own under ``BEGIN IMMEDIATE``; inside one it
+    joins the caller's transaction (which already holds the write lock) and
+    commits or rolls back with it.
+    """
+    own_tx = not conn.in_transaction
+    if own_tx:
+        conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT next_value FROM sequences WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None:
+            first = start(conn) if start else 1
+            conn.execute(
+                "INSERT INTO sequences (name, next_value) VALUES (?, ?)",
+                (name, first + count),
+            )
+        else:
+            first = row[0]
+            conn.execute(
+                "UPDATE sequences SET next_value = next_value + ? WHERE name = ?",
+                (count, name),
+            )
+        if own_tx:
+            conn.commit()
+    except sqlite3.Error:
+        if own_tx:
+            conn.rollback()
+        raise
+    return first
+
+
+class DocumentSequence:
+    """Number generator for one document type.
+
+    ``fmt`` may use ``{prefix}``, ``{year}`` and must end with a ``{seq...}``
+    field; it defaults to the app's ``DOCUMENT_NUMBER_FORMAT``. Numbers
+    already present in ``table.column`` seed a new counter, so switching
+    format or upgrading an existing database continues where it left off.
+    """
+
+    def __init__(self, prefix, table, column, fmt=None):
+        self.prefix = prefix
+        self.table = table
+        self.column = column
+        self.fmt = fmt
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def _config(self, key, default):
+        if has_app_context():
+            return current_app.config.get(key, default)
+        return default
+
+    def _stem(self, on):
+        fmt = self.fmt or self._config("DOCUMENT_NUMBER_FORMAT", DEFAULT_FORMAT)
+        head, _, tail = fmt.partition("{seq")
+        return head.format(prefix=self.prefix, year=on.year), "{seq" + tail
+
+    def _existing_max(self, stem):
+        def start(conn):
+            row = conn.execute(
+                f"SELECT MAX(CAST(substr({self.column}, ?) AS INTEGER)) "
+                f"FROM {self.table} WHERE {self.column} LIKE ? || '%' "
+                f"AND substr({self.column}, ?) NOT GLOB '*[^0-9]*'",
+                (len(stem) + 1, stem, len(stem) + 1),
+            ).fetchone()
+            return (row[0] or 0) + 1
+        return start
+
+    def _reserve(self, conn, stem, count):
+        """Return the first of ``count`` values, using the local block if possible."""
+        block_size = self._config("SEQUENCE_BLOCK_SIZE", 1)
+        start = self._existing_max(stem)
+        # A block reserved inside the caller's transaction could be rolled
+        # back after we cached it, so only use blocks for standalone calls.
+        if block_size <= 1 or count >= block_size or conn.in_transaction:
+            return allocate(conn, stem, count, start)
+        with self._lock:
+            nxt, end = self._blocks.get(stem, (0, 0))
+            if end - nxt < count:
+                nxt = allocate(conn, stem, block_size, start)
+                end = nxt + block_size
+            self._blocks[stem] = (nxt + count, end)
+            return nxt
+
+    def next_many(self, conn, count, on=None):
+        stem, seq_fmt = self._stem(on or date.today())
+        first = self._reserve(conn, stem, count)
+        return [stem + seq_fmt.format(seq=seq) for seq in range(first, first + count)]
+
+    def next(self, conn, on=None):
+        return self.next_many(conn, 1, on)[0]
@@ -0,0 +1,207 @@
+"""Per-request SQL instrumentation.
+
+While a request is being handled, every statement run through the pooled
+connection from ``get_db()`` is recorded with its normalized text, parameter
+count, number of executions (``executemany``), duration (execute + fetch) and
+rows returned. After the request:
+
+* totals are sent in a ``Server-Timing`` header (``db;dur=..;desc="N queries"``),
+* statement shapes repeated ``SQL_N_PLUS_ONE_THRESHOLD`` times or more are
+  logged as likely N+1 queries and counted in the header,
+* statements slower than ``SLOW_QUERY_MS`` go to a rotating slow-query log
+  together with their EXPLAIN QUERY PLAN.
+
+Disable with ``SQL_TRACE = False``.
+"""
+import logging
+import logging.handlers
+import os
+import re
+import sqlite3
+import time
+from collections import Counter
+
+from flask import g, request
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE_RE = re.compile(r"\s+")
+
+slow_log = logging.getLogger("erp.slow_queries")
+
+
+def normalize(sql):
+    """Reduce a statement to its shape: literals become ?, IN lists collapse."""
+    shape = _STRING_RE.sub("?", sql)
+    shape = _NUMBER_RE.sub("?", shape)
+    shape = _IN_LIST_RE.sub("(?+)", shape)
+    return _SPACE_RE.sub(" ", shape).strip()
+
+
+class QueryRecord:
+    __slots__ = ("sql", "params", "executions", "duration", "rows")
+
+    def __init__(self, sql, params, executions=1):
+        self.sql = sql
+        # For executemany, the first parameter set (enough to EXPLAIN it)
+        self.params = params
+        self.executions = executions
+        self.duration = 0.0
+        self.rows = 0
+
+    @property
+    def shape(self):
+        return normalize(self.sql)
+
+
+class RequestTrace:
+    """Statements executed while handling one request."""
+
+    def __init__(self):
+        self.records = []
+        # Set by mark_batch() for requests that repeat statements on purpose
+        self.batch = False
+
+    @property
+    def total_ms(self):
+        return sum(r.duration for r in self.records) * 1000
+
+    def repeated_shapes(self, threshold):
+        counts = Counter(r.shape for r in self.records)
+        return {shape: n for shape, n in counts.items() if n >= threshold}
+
+
+class TracingCursor(sqlite3.Cursor):
+    """Cursor that times execution and fetching into a QueryRecord."""
+
+    record = None
+
+    def _timed(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self.record.duration += time.perf_counter() - start
+
+    def execute(self, sql, parameters=()):
+        self.record = QueryRecord(sql, parameters)
+        self.trace.records.append(self.record)
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        self.record = QueryRecord(
+            sql, seq_of_parameters[0] if seq_of_parameters else (), len(seq_of_parameters)
+        )
+        self.trace.records.append(self.record)
+        result = self._timed(super().executemany, sql, seq_of_parameters)
+        self.record.rows = max(self.rowcount, 0)
+        return result
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is not None:
+            self.record.rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, size or self.arraysize)
+        self.record.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self.record.rows += len(rows)
+        return rows
+
+    def __next__(self):
+        row = self._timed(super().__next__)
+        self.record.rows += 1
+        return row
+
+
+def mark_batch():
+    """Don't report repeated statements of the current request as N+1.
+
+    For views that deliberately run the same statements per chunk, such as
+    bulk imports.
+    """
+    trace = g.get("sql_trace")
+    if trace is not None:
+        trace.batch = True
+
+
+def _explain(conn, record):
+    try:
+        rows = sqlite3.Connection.execute(
+            conn, "EXPLAIN QUERY PLAN " + record.sql, record.params
+        ).fetchall()
+    except sqlite3.Error as e:
+        return f"(no plan: {e})"
+    return "; ".join(row[3] for row in rows)
+
+
+def init_app(app, db_path):
+    app.config.setdefault("SQL_TRACE", True)
+    app.config.setdefault("SLOW_QUERY_MS", float(os.environ.get("SLOW_QUERY_MS", 100)))
+    app.config.setdefault("SQL_N_PLUS_ONE_THRESHOLD", 5)
+    app.config.setdefault(
+        "SLOW_QUERY_LOG",
+        os.environ.get(
+            "SLOW_QUERY_LOG",
+            os.path.join(os.path.dirname(db_path), "slow_queries.log"),
+        ),
+    )
+
+    if not app.config["SQL_TRACE"]:
+        return
+
+    if app.config["SLOW_QUERY_LOG"] and not slow_log.handlers:
+        handler = logging.handlers.RotatingFileHandler(
+            app.config["SLOW_QUERY_LOG"], maxBytes=1_000_000, backupCount=5, delay=True
+        )
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        slow_log.addHandler(handler)
+        slow_log.setLevel(logging.INFO)
+        slow_log.propagate = False
+
+    @app.before_request
+    def start_trace():
+        g.sql_trace = RequestTrace()
+
+    @app.after_request
+    def report_trace(response):
+        trace = g.pop("sql_trace", None)
+        if trace is None:
+            return response
+
+        metrics = [f'db;dur={trace.total_ms:.1f};desc="{len(trace.records)} queries"']
+
+        repeated = {}
+        if not trace.batch:
+            repeated = trace.repeated_shapes(app.config["SQL_N_PLUS_ONE_THRESHOLD"])
+        if repeated:
+            metrics.append(f'db-n1;desc="{len(repeated)} repeated statement shapes"')
+            for shape, count in repeated.items():
+                app.logger.warning(
+                    "Possible N+1 on %s: %dx %s", request.path, count, shape
+                )
+
+        slow_s = app.config["SLOW_QUERY_MS"] / 1000
+        conn = g.get("db")
+        for record in trace.records:
+            if record.duration >= slow_s:
+                slow_log.info(
+                    "%s %.1fms rows=%d params=%d executions=%d | %s | plan: %s",
+                    request.path,
+                    record.duration * 1000,
+                    record.rows,
+                    len(record.params),
+                    record.executions,
+                    record.shape,
+                    _explain(conn, record) if conn is not None else "-",
+                )
+
+        response.headers.add("Server-Timing", ", ".join(metrics))
+        return response
@@ -0,0 +1,44 @@
+// Contact picker: <div class="typeahead" data-url="/contacts/lookup?type=...">
+// holding a hidden id input, a text input and an empty result list.
+document.querySelectorAll('.typeahead').forEach(function(box) {
+    var hidden = box.querySelector('input[type="hidden"]');
+    var input = box.querySelector('.typeahead-input');
+    var list = box.querySelector('.typeahead-results');
+    var timer = null;
+
+    function choose(item) {
+        hidden.value = item.id;
+        input.value = item.name;
+        list.innerHTML = '';
+    }
+
+    input.addEventListener('input', function() {
+        hidden.value = '';
+        clearTimeout(timer);
+        var q = input.value.trim();
+        if (!q) {
+            list.innerHTML = '';
+            return;
+        }
+        timer = setTimeout(function() {
+            fetch(box.dataset.url + '&q=' + encodeURIComponent(q), {credentials: 'same-origin'})
+                .then(function(r) { return r.json(); })
+                .then(function(items) {
+                    list.innerHTML = '';
+                    items.forEach(function(item) {
+                        var li = document.createElement('li');
+                        li.textContent = item.city ? item.name + ' (' + item.city + ')' : item.name;
+                        li.addEventListener('mousedown', function(e) {
+                            e.preventDefault();
+                            choose(item);
+                        });
+                        list.appendChild(li);
+                    });
+                });
+        }, 150);
+    });
+
+    input.addEventListener('blur', function() {
+        list.innerHTML = '';
+    });
+});
@@ -4,9 +4,10 @@ import sqlite3
 import os
 
 from erp.db import DB_PATH
+from erp.ledger import rebuild_entry_totals, rebuild_period_balances, rebuild_running_balances
 
-def seed():
-    db = sqlite3.connect(DB_PATH)
+def seed(db_path=DB_PATH):
+    db = sqlite3.connect(db_path)
     db.execute("PRAGMA foreign_keys = ON")
 
     # --- Contacts ---
@@ -258,6 +259,9 @@ def seed():
     db.execute("UPDATE accounts SET balance = 9170.00 WHERE code = '5000'")    # COGS
     db.execute("UPDATE accounts SET balance = 28500.00 WHERE code = '5100'")   # Salaries
     db.execute("UPDATE accounts SET balance = 3500.00 WHERE code = '5200'")    # Rent
+    rebuild_entry_totals(db)
+    rebuild_period_balances(db)
+    rebuild_running_balances(db)
 
     # --- Departments ---
     departments = [